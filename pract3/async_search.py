@@ -0,0 +1,105 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+async_search.py
+Authors: Carlos Giralt and Berta Olano
+
+asyncio API over the searcher pool of server.py. The CPU-bound work (spaCy, parseQuery and the Whoosh search) runs
+in a thread executor so the event loop is never blocked; the number of searches in flight is bounded and every search
+can have a timeout. Cancelling the awaiting task (or reaching the timeout) is checked by the executor thread between
+the stages of the search and during the Whoosh matching: a spaCy analysis or parseQuery in course runs to the end, and
+the thread keeps its executor slot until it reaches the next check.
+Usage: python3 async_search.py -index <indexPath> -infoNeeds <queryFile> -output <resultsFile>
+                               [-concurrency <n>] [-timeout <seconds>] [-model tfidf|bm25]
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+from server import SearcherPool, SearchCancelled
+
+class AsyncSearcher:
+    def __init__(self, pool, max_concurrency=None, timeout=None):
+        self.pool = pool
+        self.max_concurrency = max_concurrency or pool.size
+        self.timeout = timeout      # tiempo máximo por defecto de cada búsqueda (None: sin límite)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+    # Devuelve (query procesada, resultados, generación del índice). Lanza asyncio.TimeoutError si se supera el
+    # tiempo máximo; en ese caso, o si se cancela la tarea, el hilo del executor abandona la búsqueda en la siguiente
+    # comprobación (entre etapas o durante la búsqueda de Whoosh, no en mitad del análisis con spaCy o de parseQuery)
+    async def search(self, query_text, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        async with self.semaphore:
+            cancelled = threading.Event()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self.pool.search, query_text, cancelled)
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                cancelled.set()
+                raise
+
+    # Ejecuta varias necesidades (id, texto) a la vez. Devuelve, en el mismo orden, el resultado de search o la
+    # excepción producida por cada una
+    async def search_many(self, needs, timeout=None):
+        return await asyncio.gather(*[self.search(text, timeout) for _, text in needs], return_exceptions=True)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+async def main(index_folder, query_file, results_file, concurrency, timeout, model_type):
+    root = ET.parse(query_file).getroot()
+    needs = [(child.find('identifier').text, child.find('text').text) for child in root.findall('informationNeed')]
+    pool = SearcherPool(index_folder, concurrency, model_type)
+    searcher = AsyncSearcher(pool, concurrency, timeout)
+    start = time.perf_counter()
+    answers = await searcher.search_many(needs)
+    elapsed = time.perf_counter() - start
+    searcher.close()
+    with open(results_file, 'w', encoding='utf-8') as output_file:
+        for (query_id, _), answer in zip(needs, answers):
+            if isinstance(answer, (asyncio.TimeoutError, SearchCancelled)):
+                print(f"Query {query_id}: tiempo máximo superado")
+            elif isinstance(answer, Exception):
+                print(f"Query {query_id}: error {answer}")
+            else:
+                processedQuery, results, _ = answer
+                for _, _, identifier in results:
+                    output_file.write(f"{query_id}\t{identifier}\n")
+    print(f"{len(needs)} necesidades en {elapsed:.3f} s con {concurrency} búsquedas simultáneas")
+
+if __name__ == '__main__':
+    index_folder = '../whooshindexZaguan'
+    query_file = 'necesidadesInformacion.xml'
+    results_file = 'resultados.txt'
+    concurrency = 4
+    timeout = None
+    model_type = 'tfidf'
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-index':
+            index_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-infoNeeds':
+            query_file = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-output':
+            results_file = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-concurrency':
+            concurrency = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-timeout':
+            timeout = float(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-model':
+            model_type = sys.argv[i + 1]
+            i = i + 1
+        i = i + 1
+
+    asyncio.run(main(index_folder, query_file, results_file, concurrency, timeout, model_type))
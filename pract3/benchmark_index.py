@@ -0,0 +1,216 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+benchmark_index.py
+Authors: Carlos Giralt and Berta Olano
+
+Indexing throughput benchmark. Generates synthetic Dublin Core collections of the given sizes, modeled on the
+Zaguan records indexed by MyIndex (title, subject, description, creator, contributor, publisher with department,
+date, identifier, type and language), indexes them with the pract3 and whoosh_demo indexers (each run in its own
+process) and writes a JSON report with docs/sec, analyzer time share, commit time and index size of every run.
+Usage: python3 benchmark_index.py [-sizes 10000,100000,1000000] [-work <workFolder>] [-output <report.json>]
+                                  [-indexers pract3,whoosh_demo] [-format folder|dump] [-seed <n>]
+"""
+
+import importlib.util
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Indexadores disponibles: carpeta del programa index.py de cada práctica
+INDEXERS = {
+    'pract3': os.path.join(ROOT_FOLDER, 'pract3'),
+    'whoosh_demo': os.path.join(ROOT_FOLDER, 'whoosh_demo'),
+}
+
+# Vocabulario de los registros sintéticos
+WORDS = ("análisis diseño desarrollo sistema modelo estudio evaluación aplicación gestión control red redes energía "
+         "agua suelo clima historia política economía sociedad derecho empresa mercado salud enfermedad diagnóstico "
+         "tratamiento paciente biomédica ingeniería software datos aprendizaje automático robot sensor señal imagen "
+         "materiales estructura química física matemáticas educación lengua literatura arte patrimonio turismo "
+         "aragón zaragoza huesca teruel españa europa siglo xx dictadura represión crisis alzheimer parkinson "
+         "bioinformática filogenética computacional optimización simulación eficiencia sostenibilidad").split()
+NAMES = ("Javier María Ana Pedro Laura Carlos Berta Elena Jorge Lucía Pablo Marta Sergio Raquel Diego Carmen").split()
+SURNAMES = ("García López Martínez Sánchez Pérez Gómez Fernández Ruiz Díaz Moreno Álvarez Romero Navarro Gil "
+            "Serrano Blasco Lafuente Olano Giralt Fabra").split()
+DEPARTMENTS = ["Informática e Ingeniería de Sistemas", "Ingeniería Electrónica y Comunicaciones",
+               "Historia Moderna y Contemporánea", "Análisis Económico", "Derecho Privado", "Química Orgánica",
+               "Física Aplicada", "Ingeniería Mecánica", "Ciencias de la Educación", "Medicina, Psiquiatría y Dermatología"]
+TYPES = ["TAZ-TFG", "TAZ-TFM", "TAZ-PFC", "TESIS"]
+LANGUAGES = ["spa", "spa", "spa", "eng"]
+
+def words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def person(rng):
+    return f"{rng.choice(SURNAMES)} {rng.choice(SURNAMES)}, {rng.choice(NAMES)}"
+
+# Contenido Dublin Core (elementos dc:*) de un registro sintético
+def record_fields(rng, n):
+    fields = [('title', words(rng, rng.randint(5, 15)))]
+    fields += [('creator', person(rng))]
+    fields += [('contributor', person(rng)) for _ in range(rng.randint(1, 2))]
+    fields += [('subject', words(rng, rng.randint(1, 3))) for _ in range(rng.randint(2, 5))]
+    fields += [('description', words(rng, rng.randint(60, 200)))]
+    fields += [('publisher', f"Universidad de Zaragoza; Departamento de {rng.choice(DEPARTMENTS)}; "
+                             f"Área de {rng.choice(WORDS).capitalize()}")]
+    fields += [('date', f"{rng.randint(1985, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")]
+    fields += [('identifier', f"http://zaguan.unizar.es/record/{n}"), ('identifier', f"oai:zaguan.unizar.es:{n}")]
+    fields += [('type', rng.choice(TYPES)), ('language', rng.choice(LANGUAGES))]
+    return "".join(f"<dc:{name}>{escape(value)}</dc:{name}>" for name, value in fields)
+
+DC_OPEN = ('<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+           'xmlns:dc="http://purl.org/dc/elements/1.1/">')
+
+# Genera una colección de size registros: un fichero XML por registro (como recordsdc) o un único volcado
+# OAI-PMH ListRecords. Si la colección ya existe se reutiliza
+def generate_collection(folder, size, file_format, seed):
+    marker = os.path.join(folder, '.complete')
+    if os.path.exists(marker):
+        return
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    rng = random.Random(seed)
+    if file_format == 'dump':
+        with open(os.path.join(folder, 'ListRecords.xml'), 'w', encoding='utf-8') as dump:
+            dump.write('<?xml version="1.0" encoding="UTF-8"?>'
+                       '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListRecords>')
+            for n in range(size):
+                dump.write(f'<record><header><identifier>oai:zaguan.unizar.es:{n}</identifier></header>'
+                           f'<metadata>{DC_OPEN}{record_fields(rng, n)}</oai_dc:dc></metadata></record>\n')
+            dump.write('</ListRecords></OAI-PMH>')
+    else:
+        for n in range(size):
+            with open(os.path.join(folder, f'oai_zaguan.unizar.es_{n}.xml'), 'w', encoding='utf-8') as file:
+                file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n{DC_OPEN}{record_fields(rng, n)}</oai_dc:dc>')
+    open(marker, 'w').close()
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(path, file)) for path, _, files in os.walk(folder) for file in files)
+
+# Envuelve un analizador de Whoosh para medir el tiempo que pasa generando tokens
+class TimedAnalyzer:
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.elapsed = 0.0
+
+    def __call__(self, value, **kwargs):
+        tokens = self.analyzer(value, **kwargs)
+        while True:
+            start = time.perf_counter()
+            try:
+                token = next(tokens)
+            except StopIteration:
+                self.elapsed += time.perf_counter() - start
+                return
+            self.elapsed += time.perf_counter() - start
+            yield token
+
+# Ejecuta un indexador sobre una colección (en el proceso hijo) y devuelve sus medidas
+def run_indexer(indexer, docs_folder, index_folder):
+    indexer_folder = INDEXERS[indexer]
+    sys.path.insert(0, indexer_folder)
+    spec = importlib.util.spec_from_file_location('index', os.path.join(indexer_folder, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    shutil.rmtree(index_folder, ignore_errors=True)
+    start = time.perf_counter()
+    my_index = module.MyIndex(index_folder)
+    # medimos el tiempo de los analizadores de todos los campos y el del commit sobre el writer
+    timers = []
+    for name, field in my_index.writer.schema.items():
+        if getattr(field, 'analyzer', None) is not None:
+            field.analyzer = TimedAnalyzer(field.analyzer)
+            timers.append((field, field.analyzer))
+    commit_time = [0.0]
+    writer_commit = my_index.writer.commit
+    def timed_commit(*args, **kwargs):
+        # el commit guarda el esquema del writer en el índice: se restauran los analizadores originales para que el
+        # índice no quede con los TimedAnalyzer (que no se pueden cargar fuera de este proceso)
+        for field, timer in timers:
+            field.analyzer = timer.analyzer
+        commit_start = time.perf_counter()
+        writer_commit(*args, **kwargs)
+        commit_time[0] += time.perf_counter() - commit_start
+    my_index.writer.commit = timed_commit
+    my_index.index_docs(docs_folder)
+    elapsed = time.perf_counter() - start
+
+    from whoosh.index import open_dir
+    num_docs = open_dir(index_folder).doc_count()
+    analyzer_time = sum(timer.elapsed for _, timer in timers)
+    return {'indexer': indexer, 'documents': num_docs, 'seconds': round(elapsed, 3),
+            'docs_per_sec': round(num_docs / elapsed, 1) if elapsed > 0 else 0.0,
+            'analyzer_seconds': round(analyzer_time, 3),
+            'analyzer_share': round(analyzer_time / elapsed, 3) if elapsed > 0 else 0.0,
+            'commit_seconds': round(commit_time[0], 3), 'index_bytes': folder_size(index_folder)}
+
+if __name__ == '__main__':
+    sizes = [10000, 100000, 1000000]
+    work_folder = os.path.join(tempfile.gettempdir(), 'benchmark_index')     #colecciones generadas e índices
+    output_file = 'benchmark_index.json'
+    indexers = list(INDEXERS)
+    file_format = 'folder'
+    seed = 12
+    run = None
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-sizes':
+            sizes = [int(size) for size in sys.argv[i + 1].split(',')]
+            i = i + 1
+        elif sys.argv[i] == '-work':
+            work_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-output':
+            output_file = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-indexers':
+            indexers = sys.argv[i + 1].split(',')
+            i = i + 1
+        elif sys.argv[i] == '-format':
+            file_format = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-seed':
+            seed = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-run':      # uso interno: una única ejecución en un proceso hijo
+            run = sys.argv[i + 1:i + 4]
+            i = i + 3
+        i = i + 1
+
+    if run is not None:
+        print(json.dumps(run_indexer(*run)))
+        sys.exit(0)
+
+    report = {'date': datetime.now().isoformat(timespec='seconds'), 'format': file_format, 'seed': seed, 'runs': []}
+    for size in sizes:
+        docs_folder = os.path.join(work_folder, f'{file_format}_{size}')
+        print(f"Generando colección de {size} registros en {docs_folder}")
+        generate_collection(docs_folder, size, file_format, seed)
+        for indexer in indexers:
+            if file_format == 'dump' and indexer != 'pract3':
+                print(f"  {indexer}: no admite volcados con varios registros, se omite")
+                continue
+            index_folder = os.path.join(work_folder, f'index_{indexer}_{size}')
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '-run', indexer,
+                                     os.path.abspath(docs_folder), os.path.abspath(index_folder)],
+                                    cwd=INDEXERS[indexer], capture_output=True, text=True, check=True)
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            result['records'] = size
+            report['runs'].append(result)
+            print(f"  {indexer}: {result['docs_per_sec']} docs/s, analizadores {result['analyzer_share']:.0%}, "
+                  f"commit {result['commit_seconds']} s, índice {result['index_bytes'] / 2**20:.1f} MB")
+            shutil.rmtree(index_folder, ignore_errors=True)
+
+    with open(output_file, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Informe guardado en {output_file}")
@@ -0,0 +1,125 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+benchmark_matcher.py
+Authors: Carlos Giralt and Berta Olano
+
+Micro-benchmark of the query cleanup functions of search.py (deleteUnnecessaryWords, docTypeQuery and
+languageQuery). It compares the previous implementation (one re.sub / search per vocabulary entry) with the
+precompiled single-pass matchers, reports the inputs where both outputs differ and the sentences per second.
+Usage: python3 benchmark_matcher.py [-infoNeeds <queryFile.xml>] [-queries <queryFile.txt>] [-repeat <n>]
+"""
+
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from whoosh.query import Or, Term
+
+from search import (TFG_equivalents, TFM_equivalents, Tesis_equivalents, PFC_equivalents, Spanish_equivalents,
+                    English_equivalents, Other_Words, Stop_words, cleanQuery, deleteUnnecessaryWords,
+                    docTypeQuery, languageQuery)
+
+# Implementación anterior de deleteUnnecessaryWords: un re.sub por cada palabra de cada lista
+def legacyDeleteUnnecessaryWords(sentence):
+    lowerCase = sentence.lower()
+    deleteWords = [TFG_equivalents, TFM_equivalents, Tesis_equivalents, PFC_equivalents,
+                    Spanish_equivalents, English_equivalents, Other_Words]
+    for dict in deleteWords:
+        for word in dict:
+             lowerCase = re.sub(r'\b' + re.escape(word) + r'\b', '', lowerCase)
+    for stop in Stop_words:
+        lowerCase = re.sub(r'\b' + re.escape(stop) + r'\b', '', lowerCase)
+    lowerCase = re.sub(r'\s+', ' ', lowerCase).strip()
+    return lowerCase
+
+# Implementación anterior de docTypeQuery: una búsqueda de subcadena por expresión
+def legacyDocTypeQuery(query_text):
+    lowerCaseQuery = query_text.lower()
+    typeSearched = []
+    for dict in [TFG_equivalents, TFM_equivalents, Tesis_equivalents, PFC_equivalents]:
+        for word in dict:
+            if word in lowerCaseQuery:
+                t = Term("docType", dict[0])
+                t.boost *= 1.5
+                typeSearched.append(t)
+    return Or(typeSearched)
+
+# Implementación anterior de languageQuery: un re.search por expresión
+def legacyLanguageQuery(query_text):
+    lowerCaseQuery = query_text.lower()
+    langSearched = []
+    for term in Spanish_equivalents:
+        if re.search(r'.*' + term + r'.*', lowerCaseQuery):
+            t = Term("language", "es")
+            t.boost *= 2.0
+            langSearched.append(t)
+    for term in English_equivalents:
+        if re.search(r'.*' + term + r'.*', lowerCaseQuery):
+            t = Term("language", "eng")
+            t.boost *= 2.0
+            langSearched.append(t)
+    return Or(langSearched)
+
+# Detección de tipo de documento e idioma tal y como se hace en parseQuery: ambas sobre la misma consulta
+def legacyDetection(query_text):
+    return legacyDocTypeQuery(query_text), legacyLanguageQuery(query_text)
+
+def detection(query_text):
+    return docTypeQuery(query_text), languageQuery(query_text)
+
+# Carga las frases de las consultas: cada necesidad de información se divide en frases igual que en mainQuery
+def load_corpus(info_needs_files, query_files):
+    texts = []
+    for file_name in info_needs_files:
+        root = ET.parse(file_name).getroot()
+        texts += [child.find('text').text for child in root.findall('informationNeed')]
+    for file_name in query_files:
+        with open(file_name, 'r', encoding='utf-8') as query_file:
+            texts += [line.strip() for line in query_file if line.strip()]
+    sentences = []
+    for text in texts:
+        sentences += [sentence.strip() for sentence in cleanQuery(text).lower().split('.') if sentence.strip()]
+    return texts, sentences
+
+# Ejecuta la función sobre todas las entradas repeat veces y devuelve las entradas procesadas por segundo
+def throughput(function, inputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            function(item)
+    elapsed = time.perf_counter() - start
+    return len(inputs) * repeat / elapsed
+
+if __name__ == '__main__':
+    info_needs_files = []
+    query_files = []
+    repeat = 200
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-infoNeeds':
+            info_needs_files.append(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-queries':
+            query_files.append(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-repeat':
+            repeat = int(sys.argv[i + 1])
+            i = i + 1
+        i = i + 1
+    if not info_needs_files and not query_files:
+        info_needs_files = ['necesidadesInformacion.xml']
+
+    texts, sentences = load_corpus(info_needs_files, query_files)
+    print(f"Corpus: {len(texts)} consultas, {len(sentences)} frases, {repeat} repeticiones")
+
+    cases = [("deleteUnnecessaryWords", legacyDeleteUnnecessaryWords, deleteUnnecessaryWords, sentences),
+             ("docTypeQuery + languageQuery", legacyDetection, detection, texts)]
+    for name, before, after, inputs in cases:
+        mismatches = [item for item in inputs if repr(before(item)) != repr(after(item))]
+        before_rate = throughput(before, inputs, repeat)
+        after_rate = throughput(after, inputs, repeat)
+        print(f"{name}: antes {before_rate:.0f}/s, después {after_rate:.0f}/s, "
+              f"aceleración x{after_rate / before_rate:.1f}, diferencias {len(mismatches)}")
+        for item in mismatches:
+            print(f"  diferencia en: '{item}'")
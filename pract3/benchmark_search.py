@@ -0,0 +1,208 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+benchmark_search.py
+Authors: Carlos Giralt and Berta Olano
+
+Query latency benchmark for search.py. Replays the information needs of a file against MySearcher and reports
+p50/p95/p99 latency of every stage of the query processing: cleanQuery, mainQuery, docTypeQuery, languageQuery,
+namesQuery (spaCy), departmentQuery, publishingYearQuery, the Whoosh search and the writing of the results.
+With -compareTopK it instead runs every need with the default, topk and exhaustive execution modes of MySearcher
+and reports, for each pruned mode, the needs whose results differ from the unpruned ranking of the exhaustive mode,
+and the latency of each mode. With -compareFacets it compares the
+latency of the top results alone, of the top results with all the facet counts (MySearcher.facetSearch) and of
+computing the same counts with one extra query per facet value, and checks that both ways give the same counts.
+Usage: python3 benchmark_search.py -index <indexPath> -infoNeeds <queryFile> [-repeat <n>] [-model tfidf|bm25]
+                                   [-output <report.json>] [-compareTopK] [-compareFacets]
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from whoosh.query import And, NumericRange, Term
+
+from instrumentation import Instrumentation
+from search import MySearcher, parseQuery
+
+STAGES = ['cleanQuery', 'mainQuery', 'docTypeQuery', 'languageQuery', 'namesQuery', 'departmentQuery',
+          'publishingYearQuery', 'whoosh', 'write', 'total']
+
+# Percentiles de una lista de tiempos en segundos, en milisegundos
+def latency(times):
+    ms = np.array(times) * 1000
+    return {'mean_ms': round(float(ms.mean()), 3), 'p50_ms': round(float(np.percentile(ms, 50)), 3),
+            'p95_ms': round(float(np.percentile(ms, 95)), 3), 'p99_ms': round(float(np.percentile(ms, 99)), 3)}
+
+# Percentiles de cada etapa en milisegundos, a partir de los registros de la instrumentación de MySearcher
+def stage_report(records):
+    report = {}
+    for stage in STAGES:
+        times = [record['timings'][stage] for record in records if stage in record['timings']]
+        if times:
+            report[stage] = {'count': len(times), **latency(times)}
+    return report
+
+# Procesa y ejecuta una necesidad como search.py; los tiempos de cada etapa los toman los timers de parseQuery y
+# MySearcher en el registro de la necesidad
+def timed_search(searcher, query_id, query_text, sink):
+    with searcher.instrumentation.query(query_id):
+        query = parseQuery(query_text, searcher)
+        with contextlib.redirect_stdout(sink):
+            searcher.search(query, query_id, sink)
+
+# Ejecuta cada necesidad con los modos con poda (default y topk) y con la puntuación exhaustiva, sin poda ni
+# sustitución del matcher: necesidades cuyos resultados difieren de los exhaustivos en cada modo y latencias
+def compare_topk(index_folder, model_type, needs, repeat):
+    searchers = {mode: MySearcher(index_folder, model_type, plan_cache_size=0, execution=mode)
+                 for mode in ('default', 'topk', 'exhaustive')}
+    times = {mode: [] for mode in searchers}
+    mismatches = {mode: [] for mode in searchers if mode != 'exhaustive'}
+    for query_id, query_text in needs:
+        query = parseQuery(query_text, searchers['exhaustive'])
+        results = {}
+        for mode, searcher in searchers.items():
+            results[mode] = searcher.run_query(query)
+            for _ in range(repeat):
+                start = time.perf_counter()
+                searcher.run_query(query)
+                times[mode].append(time.perf_counter() - start)
+        # mismos documentos, en el mismo orden y con la misma puntuación que la ejecución exhaustiva
+        expected = [(path, round(score, 9)) for path, score, _ in results['exhaustive']]
+        for mode in mismatches:
+            if [(path, round(score, 9)) for path, score, _ in results[mode]] != expected:
+                mismatches[mode].append(query_id)
+    return {'queries': len(needs), 'mismatches': mismatches,
+            'latency': {mode: latency(mode_times) for mode, mode_times in times.items()}}
+
+# Recuentos por faceta de la query con una consulta extra por cada valor de cada faceta
+def facets_by_queries(searcher, query):
+    facets = {}
+    for fieldname, field in searcher.facetIndex().fields.items():
+        counts = []
+        for label in field.labels:
+            value = NumericRange(fieldname, label, label) if isinstance(label, int) else Term(fieldname, label)
+            count = sum(1 for _ in searcher.searcher.docs_for_query(And([query, value])))
+            if count:
+                counts.append((label, count))
+        facets[fieldname] = sorted(counts, key=lambda item: -item[1])
+    return facets
+
+# Latencias de los 100 primeros resultados, de los resultados con las facetas y de las facetas por consultas extra
+def compare_facets(index_folder, model_type, needs, repeat):
+    searcher = MySearcher(index_folder, model_type, plan_cache_size=0)
+    start = time.perf_counter()
+    facet_index = searcher.facetIndex()
+    build_time = time.perf_counter() - start
+    times = {'results': [], 'results+facets': [], 'results+facet queries': []}
+    mismatches = []
+    for query_id, query_text in needs:
+        query = parseQuery(query_text, searcher)
+        _, facets = searcher.facetSearch(query)
+        # mismos recuentos (en cualquier orden entre valores empatados)
+        expected = facets_by_queries(searcher, query)
+        if any(sorted(facets[name]) != sorted(expected[name]) for name in facet_index.fields):
+            mismatches.append(query_id)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            searcher.run_query(query)
+            times['results'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            searcher.facetSearch(query)
+            times['results+facets'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            searcher.run_query(query)
+            facets_by_queries(searcher, query)
+            times['results+facet queries'].append(time.perf_counter() - start)
+    return {'documents': searcher.searcher.doc_count(), 'queries': len(needs), 'mismatches': mismatches,
+            'facet_values': {name: len(field.labels) for name, field in facet_index.fields.items()},
+            'build_ms': round(build_time * 1000, 3),
+            'latency': {mode: latency(mode_times) for mode, mode_times in times.items()}}
+
+if __name__ == '__main__':
+    index_folder = '../whooshindexZaguan'
+    query_file = 'necesidadesInformacion.xml'
+    repeat = 10
+    model_type = 'tfidf'
+    output_file = None
+    topk = False
+    facets = False
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-index':
+            index_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-infoNeeds':
+            query_file = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-repeat':
+            repeat = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-model':
+            model_type = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-output':
+            output_file = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-compareTopK':
+            topk = True
+        elif sys.argv[i] == '-compareFacets':
+            facets = True
+        i = i + 1
+
+    root = ET.parse(query_file).getroot()
+    needs = [(child.find('identifier').text, child.find('text').text) for child in root.findall('informationNeed')]
+
+    if topk:
+        report = compare_topk(index_folder, model_type, needs, repeat)
+        print(f"{len(needs)} necesidades x {repeat} repeticiones")
+        for mode, mode_mismatches in report['mismatches'].items():
+            print(f"Diferencias de {mode} con exhaustive: {len(mode_mismatches)} {mode_mismatches}")
+        print(f"{'modo':<22}{'media':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+        for mode, stats in report['latency'].items():
+            print(f"{mode:<22}{stats['mean_ms']:>10.3f}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+        if output_file:
+            with open(output_file, 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+        sys.exit(0)
+
+    if facets:
+        report = compare_facets(index_folder, model_type, needs, repeat)
+        print(f"{report['documents']} documentos, {len(needs)} necesidades x {repeat} repeticiones, diferencias: "
+              f"{len(report['mismatches'])} {report['mismatches']}")
+        print(f"Arrays de las facetas {report['facet_values']} construidos en {report['build_ms']} ms")
+        print(f"{'modo':<22}{'media':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+        for mode, stats in report['latency'].items():
+            print(f"{mode:<22}{stats['mean_ms']:>10.3f}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+        if output_file:
+            with open(output_file, 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+        sys.exit(0)
+
+    start = time.perf_counter()
+    # sin caché de queries, para que cada repetición pase por todas las etapas de parseQuery
+    searcher = MySearcher(index_folder, model_type, instrumentation=Instrumentation(), plan_cache_size=0)
+    open_time = time.perf_counter() - start
+    start = time.perf_counter()
+    searcher.get_nlp()      # la carga del modelo de spaCy se mide aparte
+    nlp_load_time = time.perf_counter() - start
+
+    with open(os.devnull, 'w', encoding='utf-8') as sink:
+        for _ in range(repeat):
+            for query_id, query_text in needs:
+                timed_search(searcher, query_id, query_text, sink)
+
+    report = {'index': index_folder, 'infoNeeds': query_file, 'queries': len(needs), 'repeat': repeat,
+              'model': model_type, 'open_index_ms': round(open_time * 1000, 3),
+              'spacy_load_ms': round(nlp_load_time * 1000, 3), 'stages': stage_report(searcher.instrumentation.records)}
+    print(f"{len(needs)} necesidades x {repeat} repeticiones. Apertura del índice {report['open_index_ms']} ms, "
+          f"carga de spaCy {report['spacy_load_ms']} ms")
+    print(f"{'etapa':<22}{'media':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for stage, stats in report['stages'].items():
+        print(f"{stage:<22}{stats['mean_ms']:>10.3f}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
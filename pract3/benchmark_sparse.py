@@ -0,0 +1,151 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+benchmark_sparse.py
+Authors: Carlos Giralt and Berta Olano
+
+Parity check and latency comparison of the sparse-matrix backend of sparse_search.py against Whoosh. It generates a
+small synthetic Dublin Core collection (benchmark_index.py) and indexes it with MyIndex three ways: a single segment,
+several unmerged segments and a single segment updated with -update (modified, deleted and new records). For every
+index and scoring model (tfidf and bm25) each information need is run with the unpruned Whoosh ranking
+(MySearcher in exhaustive mode) and with SparseSearcher, both as built by parseQuery and combined with a phrase and a
+term range that the matrices cannot evaluate (scored by the Whoosh fallback). It reports the needs whose top 100
+identifiers differ or whose scores differ by more than SCORE_TOLERANCE, and the latency of both engines.
+Usage: python3 benchmark_sparse.py [-infoNeeds <queryFile>] [-size <records>] [-work <workFolder>] [-seed <n>]
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from whoosh.query import Or, TermRange
+
+from benchmark_index import generate_collection, record_fields, DC_OPEN
+from index import MyIndex
+from search import MySearcher, parseQuery, cleanQuery, deleteUnnecessaryWords
+from sparse_search import SparseSearcher
+
+MODELS = ('tfidf', 'bm25')
+# Diferencia máxima admitida entre las puntuaciones de ambos motores
+SCORE_TOLERANCE = 1e-9
+# Fracción de los registros que se modifican, se eliminan y se añaden antes de la actualización
+UPDATE_FRACTION = 0.1
+
+# Indexa la colección con MyIndex sin mostrar su salida
+def build_index(docs_folder, index_folder, update=False, commit_every=0, merge_policy='default'):
+    if not update:
+        shutil.rmtree(index_folder, ignore_errors=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        my_index = MyIndex(index_folder, update, commit_every=commit_every, merge_policy=merge_policy)
+        my_index.index_docs(docs_folder)
+    return my_index.segment_count()
+
+# Copia la colección y modifica, elimina y añade algunos registros con una fecha de modificación posterior, de modo
+# que -update los reindexe
+def update_collection(docs_folder, updated_folder, size, seed):
+    shutil.rmtree(updated_folder, ignore_errors=True)
+    shutil.copytree(docs_folder, updated_folder)
+    rng = random.Random(seed + 1)
+    count = max(1, int(size * UPDATE_FRACTION))
+    changed = rng.sample(range(size), 2 * count)
+    mtime = time.time() + 60
+    for n in changed[:count]:
+        file_path = os.path.join(updated_folder, f'oai_zaguan.unizar.es_{n}.xml')
+        with open(file_path, 'w', encoding='utf-8') as file:
+            file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n{DC_OPEN}{record_fields(rng, n)}</oai_dc:dc>')
+        os.utime(file_path, (mtime, mtime))
+    for n in changed[count:]:
+        os.remove(os.path.join(updated_folder, f'oai_zaguan.unizar.es_{n}.xml'))
+    for n in range(size, size + count):
+        with open(os.path.join(updated_folder, f'oai_zaguan.unizar.es_{n}.xml'), 'w', encoding='utf-8') as file:
+            file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n{DC_OPEN}{record_fields(rng, n)}</oai_dc:dc>')
+
+# Queries de las necesidades: la de parseQuery y la misma con una frase (Phrase) y un rango de términos (TermRange),
+# que el motor de matrices evalúa con Whoosh
+def build_queries(searcher, needs):
+    queries = []
+    for query_id, text in needs:
+        query = parseQuery(text, searcher)
+        queries.append((query_id, query))
+        words = deleteUnnecessaryWords(cleanQuery(text).replace('.', ' ')).split()
+        if len(words) >= 2:
+            phrase = searcher.MainParser.parse(f'"{words[0]} {words[1]}"')
+            queries.append((query_id + '+fallback', Or([query, phrase, TermRange('subject', 'a', 'c', boost=0.5)])))
+    return queries
+
+# Compara los 100 primeros resultados de ambos motores para todas las queries. Devuelve las queries con diferencias,
+# la mayor diferencia de puntuación y los tiempos de cada motor
+def compare(index_folder, model_type, needs):
+    whoosh = MySearcher(index_folder, model_type, plan_cache_size=0, execution='exhaustive')
+    sparse = SparseSearcher(index_folder, model_type, plan_cache_size=0, rebuild=True)
+    whoosh.nlp = sparse.nlp = sparse.get_nlp()
+    mismatches, max_diff, times = [], 0.0, {'whoosh': [], 'sparse': []}
+    for query_id, query in build_queries(sparse, needs):
+        start = time.perf_counter()
+        expected = whoosh.run_query(query)
+        times['whoosh'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        results = sparse.run_query(query)
+        times['sparse'].append(time.perf_counter() - start)
+        same_ids = [identifier for _, _, identifier in expected] == [identifier for _, _, identifier in results]
+        diff = max((abs(a[1] - b[1]) for a, b in zip(expected, results)), default=0.0)
+        max_diff = max(max_diff, diff)
+        if not same_ids or diff > SCORE_TOLERANCE:
+            mismatches.append(query_id)
+    return mismatches, max_diff, times
+
+if __name__ == '__main__':
+    info_needs_file = 'necesidadesInformacion.xml'
+    size = 2000
+    work_folder = os.path.join(tempfile.gettempdir(), 'benchmark_sparse')
+    seed = 12
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-infoNeeds':
+            info_needs_file = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-size':
+            size = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-work':
+            work_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-seed':
+            seed = int(sys.argv[i + 1])
+            i = i + 1
+        i = i + 1
+
+    root = ET.parse(info_needs_file).getroot()
+    needs = [(child.find('identifier').text, child.find('text').text) for child in root.findall('informationNeed')]
+    docs_folder = os.path.join(work_folder, f'folder_{size}')
+    updated_folder = os.path.join(work_folder, f'folder_{size}_updated')
+    generate_collection(docs_folder, size, 'folder', seed)
+    update_collection(docs_folder, updated_folder, size, seed)
+
+    indexes = []
+    index_folder = os.path.join(work_folder, 'single')
+    indexes.append(('un segmento', index_folder, build_index(docs_folder, index_folder, merge_policy='optimize')))
+    index_folder = os.path.join(work_folder, 'segments')
+    indexes.append(('varios segmentos', index_folder,
+                    build_index(docs_folder, index_folder, commit_every=max(1, size // 4), merge_policy='none')))
+    index_folder = os.path.join(work_folder, 'updated')
+    build_index(docs_folder, index_folder, merge_policy='optimize')
+    indexes.append(('actualizado', index_folder, build_index(updated_folder, index_folder, update=True)))
+
+    failed = False
+    for name, index_folder, segments in indexes:
+        for model_type in MODELS:
+            mismatches, max_diff, times = compare(index_folder, model_type, needs)
+            failed = failed or bool(mismatches)
+            print(f"{name} ({segments} segmentos), {model_type}: diferencias {len(mismatches)}, "
+                  f"máxima diferencia de puntuación {max_diff:.2e}, "
+                  f"Whoosh {np.mean(times['whoosh']) * 1000:.1f} ms, matrices {np.mean(times['sparse']) * 1000:.1f} ms")
+            for query_id in mismatches:
+                print(f"  diferencia en: {query_id}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,88 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+column_store.py
+Authors: Carlos Giralt and Berta Olano
+
+
+Columnar store of the numeric metadata of an index (publishingyear and the BoundingBox coordinates). Every column is
+a fixed-width NumPy array indexed by Whoosh docnum, saved as a .npy file in the COLUMNS_FOLDER of the index together
+with the version of the index it was written for, and memory-mapped by the searchers. The columns are rebuilt from
+the postings of the NUMERIC fields after each commit, so they cover every way of building the index (serial,
+parallel, updates and merges). Documents without a value get MISSING_INT (integer columns) or NaN (float columns).
+"""
+import json
+import os
+
+import numpy as np
+
+from index_version import index_version
+
+COLUMNS_FOLDER = 'columns'
+MISSING_INT = np.iinfo(np.int32).min
+
+# Columna de un campo NUMERIC: para cada término a precisión completa, su valor en todos los documentos que lo contienen
+def numeric_column(reader, schema, fieldname):
+    field = schema[fieldname]
+    if field.numtype is int:
+        column = np.full(reader.doc_count_all(), MISSING_INT, dtype=np.int32)
+    else:
+        column = np.full(reader.doc_count_all(), np.nan, dtype=np.float64)
+    for term in field.sortable_terms(reader, fieldname):
+        docnums = np.fromiter(reader.postings(fieldname, term).all_ids(), dtype=np.int64)
+        column[docnums] = field.from_bytes(term)
+    return column
+
+# Escribe las columnas de los campos indicados para la última versión (generación y commit) del índice
+def write_columns(index, fieldnames):
+    folder = os.path.join(index.storage.folder, COLUMNS_FOLDER)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    version = index_version(index)
+    with index.reader() as reader:
+        for fieldname in fieldnames:
+            column = numeric_column(reader, index.schema, fieldname)
+            tmp_path = os.path.join(folder, fieldname + '.tmp.npy')
+            np.save(tmp_path, column)
+            os.replace(tmp_path, os.path.join(folder, fieldname + '.npy'))
+        doc_count = reader.doc_count_all()
+    # los metadatos se escriben al final: hasta entonces las columnas no se consideran válidas
+    tmp_path = os.path.join(folder, 'columns.tmp.json')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({'version': version, 'doc_count': doc_count, 'columns': list(fieldnames)}, file)
+    os.replace(tmp_path, os.path.join(folder, 'columns.json'))
+
+class ColumnStore:
+    def __init__(self, folder, columns, version):
+        self.version = version
+        # columnas proyectadas en memoria (solo lectura)
+        self.columns = {name: np.load(os.path.join(folder, name + '.npy'), mmap_mode='r') for name in columns}
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    # Abre las columnas de un índice. Devuelve None si no existen o se escribieron para otra versión del índice
+    @classmethod
+    def load(cls, index):
+        version = index_version(index)
+        folder = os.path.join(index.storage.folder, COLUMNS_FOLDER)
+        meta_path = os.path.join(folder, 'columns.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta['version'] != version:
+            return None
+        return cls(folder, meta['columns'], version)
+
+    # Documentos (ordenados) cuyo valor está en [start, end]; un extremo None no limita
+    def range_docs(self, name, start=None, end=None):
+        column = self.columns[name]
+        mask = column != MISSING_INT if column.dtype == np.int32 else ~np.isnan(column)
+        if start is not None:
+            mask &= column >= start
+        if end is not None:
+            mask &= column <= end
+        return np.flatnonzero(mask)
@@ -6,16 +6,32 @@ Authors: Carlos Giralt and Berta Olano
 
 Program to create a filter based on the Snowball stemmer
 """
+from functools import lru_cache
 from whoosh.analysis import Filter
 from nltk.stem.snowball import SnowballStemmer
 
+# Tamaño máximo de la caché de raíces (número de palabras distintas recordadas)
+STEM_CACHE_SIZE = 100000
+
+#Definimos un stemmer en español basado en el metodo Snowball, compartido por todos los filtros
+spanish_stemmer = SnowballStemmer('spanish')
+
+# Caché LRU palabra -> raíz, a nivel de módulo para que la compartan los filtros de todos los campos
+# del esquema (y no se guarde dentro del esquema serializado en el índice)
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def cached_stem(word):
+    return spanish_stemmer.stem(word)
+
+# Estadísticas de la caché: aciertos (hits), fallos (misses), tamaño máximo y tamaño actual
+def stem_cache_info():
+    return cached_stem.cache_info()
+
+def clear_stem_cache():
+    cached_stem.cache_clear()
+
 class CustomSpanishStemmingFilter(Filter):
-    def __init__(self):
-        #Definimos un stemmer en español basado en el metodo Snowball
-        self.stemmer = SnowballStemmer('spanish')
-    
     def __call__(self, tokens):
         #tokenizamos el texto obtenido
         for token in tokens:
-            token.text = self.stemmer.stem(token.text)
+            token.text = cached_stem(token.text)
             yield token
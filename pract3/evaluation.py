@@ -6,6 +6,7 @@ Authors: Carlos Giralt and Berta Olano
 Program to search a free text query on a previously created inverted index.
 This program is based on the whoosh library. See https://pypi.org/project/Whoosh/ .
 Usage: python3 evaluation.py -qrels <qrelsFileName> -results <resultsFileName> -output <outputFileName>
+       python3 evaluation.py -batch -qrels <qrelsFileName> -results <resultsFileName> [-results ...] -output <outputFileName>
 
 """
 
@@ -24,7 +25,7 @@ class InformationNeed:
 
     def get_relevant_documents(self):
         # Filtra y devuelve solo los documentos relevantes
-        return list({doc_id: rel for doc_id, rel in self.documents.items() if rel == 1})
+        return [doc_id for doc_id, rel in self.documents.items() if rel == 1]
     
     def get_documents(self):
        # return {self.documents.keys()}
@@ -41,15 +42,95 @@ class Results:
         self.information_needs[need_id].append(doc_id)
     
     def get_documents_from_infoNeed(self, need_id):
-        return list(self.information_needs[need_id])
+        # una necesidad sin resultados devuelve una lista vacía
+        return list(self.information_needs.get(need_id, []))
         #return list(self.relevant_documents.keys())
     
     def get_relevant_documents_from_infoNeed(self, need_id: int, infoNeed: InformationNeed):
-        res = []
-        for doc in self.get_documents_from_infoNeed(need_id):
-            if doc in infoNeed.get_relevant_documents():
-                res.append(doc)
-        return res
+        relevant = set(infoNeed.get_relevant_documents())
+        return [doc for doc in self.get_documents_from_infoNeed(need_id) if doc in relevant]
+
+
+# Métricas de una necesidad de información. Se calculan en una única pasada por la lista de resultados a partir
+# del conjunto de documentos relevantes y del número acumulado de relevantes recuperados en cada posición
+class NeedEvaluation:
+    def __init__(self, relevant_docs, retrieved_docs):
+        self.relevant = set(relevant_docs)
+        self.retrieved = retrieved_docs
+        self.num_relevant = len(self.relevant)
+        # cumulative_hits[k] = número de documentos relevantes entre los k+1 primeros resultados
+        self.cumulative_hits = []
+        # precisión y recall en la posición de cada documento relevante recuperado
+        self.precisions = []
+        self.recalls = []
+        hits = 0
+        for index, doc in enumerate(retrieved_docs):
+            if doc in self.relevant:
+                hits += 1
+                self.precisions.append(hits / (index + 1))
+                self.recalls.append(hits / self.num_relevant)
+            self.cumulative_hits.append(hits)
+
+    # Número de resultados considerados en el corte k (todos si k es None)
+    def cut(self, k=None):
+        if k is None:
+            return len(self.retrieved)
+        return min(k, len(self.retrieved))
+
+    def tp(self, k=None):
+        k = self.cut(k)
+        return self.cumulative_hits[k - 1] if k > 0 else 0
+
+    def fp(self, k=None):
+        return self.cut(k) - self.tp(k)
+
+    def fn(self, k=None):
+        return self.num_relevant - self.tp(k)
+
+    def precision(self, k=None):
+        k = self.cut(k)
+        return self.tp(k) / k if k > 0 else 0.0
+
+    def recall(self, k=None):
+        # Evitar la división por cero si no hay documentos relevantes
+        if self.num_relevant == 0:
+            return 0.0
+        return self.tp(k) / self.num_relevant
+
+    def f1(self):
+        P = self.precision()
+        R = self.recall()
+        return (2 * P * R) / (P + R) if P + R > 0 else 0.0
+
+    # Si hay menos de 10 resultados, los que faltan cuentan como no relevantes
+    def prec10(self):
+        return self.tp(10) / 10
+
+    # Media de las precisiones en la posición de cada documento relevante recuperado
+    def average_precision(self):
+        if self.num_relevant == 0 or not self.precisions:
+            return 0.0
+        return sum(self.precisions) / len(self.precisions)
+
+    def recall_precision(self):
+        return self.precisions, self.recalls
+
+    def recall_precision_interpolated(self):
+        # Lista de recalls estándar donde interpolaremos las precisiones
+        recall_levels = [i / 10.0 for i in range(11)]
+        # máxima precisión desde cada punto hasta el final (el recall no decrece a lo largo de la lista)
+        max_from = [0.0] * (len(self.precisions) + 1)
+        for point in range(len(self.precisions) - 1, -1, -1):
+            max_from[point] = max(max_from[point + 1], self.precisions[point])
+        # Aplicamos la interpolación de precisión para cada nivel de recall estándar: máxima precisión
+        # para los puntos con recall >= recall_level
+        interpolated_precisions = []
+        point = 0
+        for recall_level in recall_levels:
+            while point < len(self.recalls) and self.recalls[point] < recall_level:
+                point += 1
+            interpolated_precisions.append(max_from[point])
+        return recall_levels, interpolated_precisions
 
 
 class Evaluation:
@@ -65,181 +146,192 @@ class Evaluation:
         # Agregar el documento y su relevancia
         self.information_needs[information_need_id].add_document(document_id, relevancy)
 
+    # Calcula todas las métricas de una necesidad de información en una única pasada
+    def evaluate(self, info_id, results: Results) -> NeedEvaluation:
+        return NeedEvaluation(self.information_needs[info_id].get_relevant_documents(),
+                              results.get_documents_from_infoNeed(info_id))
+
     def tp(self, info_id: int, results: Results, k: int = None) -> int:
-        tp = 0
-        if k is None:
-            k = len(results.get_documents_from_infoNeed(info_id))
-        for docid in results.get_documents_from_infoNeed(info_id)[:k]:
-            if docid in self.information_needs[info_id].get_relevant_documents():
-                tp += 1
-        return tp
+        return self.evaluate(info_id, results).tp(k)
 
     def fp(self, info_id: int, results: Results, k: int = None) -> int:
-        fp=0
-        if k is None:
-            k = len(results.get_documents_from_infoNeed(info_id))
-        for docid in results.get_documents_from_infoNeed(info_id)[:k]:
-            if docid not in self.information_needs[info_id].get_relevant_documents():
-                fp += 1
-        return fp
+        return self.evaluate(info_id, results).fp(k)
     
     def fn(self, info_id: int, results: Results, k: int = None) -> int:
-        fn = 0
-        if k is None:
-            k = len(results.get_documents_from_infoNeed(info_id))
-        for docid in self.information_needs[info_id].get_relevant_documents()[:k]:
-            if docid not in results.get_documents_from_infoNeed(info_id):
-                fn += 1
-        return fn
-
+        return self.evaluate(info_id, results).fn(k)
 
-    
     def precision(self, info_id: int, results: Results, k: int = None) -> float:
-        return self.tp(info_id, results,k)/(self.tp(info_id, results, k)+self.fp(info_id, results, k))
+        return self.evaluate(info_id, results).precision(k)
 
-    
-    #def recall(self, info_id: int, results: Results, k: int = None) -> float:
-       # return self.tp(info_id, results, k)/(self.tp(info_id, results, k)+self.fn(info_id, results, k))
-    def recall(self, info_id, results: Results, at_index):
-        relevant_docs = self.information_needs[info_id].get_relevant_documents()
-        retrieved_docs = results.get_documents_from_infoNeed(info_id)[:at_index]  # Considerar los primeros 'at_index' documentos
-        
-        relevant_retrieved = 0
-        for doc in retrieved_docs:
-            if doc in relevant_docs:
-                relevant_retrieved += 1  # Cuenta solo los relevantes recuperados hasta aquí
-
-        # Evitar la división por cero si no hay documentos relevantes
-        if len(relevant_docs) == 0:
-            return 0.0
-        
-        # Cálculo del recall
-        return relevant_retrieved / len(relevant_docs)
+    def recall(self, info_id, results: Results, at_index = None):
+        # Considerar los primeros 'at_index' documentos
+        return self.evaluate(info_id, results).recall(at_index)
 
     def f1(self, info_id: int, results: Results) -> float:
-        P = self.precision(info_id, results)
-        R = self.recall(info_id, results,len(results.get_documents_from_infoNeed(info_id)))
-        return (2 * P * R) / (P + R)
+        return self.evaluate(info_id, results).f1()
     
     def prec10(self, info_id: int, results: Results) -> float:
-        if len(results.get_documents_from_infoNeed(info_id)) < 10:
-            return self.tp(info_id, Results) / 10
-        else:
-            return self.precision(info_id,results,10)
+        return self.evaluate(info_id, results).prec10()
     
     def average_precision(self, info_id, results):
-        sum_precisions = 0.0
-        relevant_docs = self.information_needs[info_id].get_relevant_documents()
-        retrieved_docs = results.get_documents_from_infoNeed(info_id)
-        num_relevant = len(relevant_docs)
-        
-        if num_relevant == 0:
-            return 0.0
-
-        relevant_retrieved_count = 0  # Contador de documentos relevantes recuperados
-        for index, doc in enumerate(retrieved_docs):
-        #for index, doc in enumerate(retrieved_docs):
-            if doc in relevant_docs:
-                relevant_retrieved_count += 1
-                print(index)
-                # Calculamos la precisión hasta este punto
-                #precision_at_k = relevant_retrieved_count / (index + 1)
-                precision_at_k = self.precision(info_id,results,index+1)
-                sum_precisions += precision_at_k
-        
-        return sum_precisions / relevant_retrieved_count
-    
-        """
-        n_relevant_docs = len(self.information_needs[info_id].get_relevant_documents())
-        #print(n_relevant_docs)
-        if (len(results.get_relevant_documents_from_infoNeed(info_id, self.information_needs[info_id])) == 0):
-            return 0
-        sum = 0
-        for i in range (n_relevant_docs):
-            sum += self.precision(info_id, results, i+1)
-            print(sum)
-        return sum / n_relevant_docs
-        """
-
-
+        return self.evaluate(info_id, results).average_precision()
 
     def recall_precision(self, info_id, results: Results):
-        precisions = []
-        recalls = []
-        
-        retrieved_docs = results.get_documents_from_infoNeed(info_id)
-        relevant_docs = self.information_needs[info_id].get_relevant_documents()
-
-        for index, doc in enumerate(retrieved_docs):
-            if doc in relevant_docs:
-                precision = self.precision(info_id, results, index + 1)
-                recall = self.recall(info_id, results, index + 1)
-
-                print(f"Doc: {doc} | Precision: {precision:.3f} | Recall: {recall:.3f}")
-                
-                precisions.append(precision)
-                recalls.append(recall)
-
-        return precisions, recalls
-
+        return self.evaluate(info_id, results).recall_precision()
 
     def recall_precision_interpolated(self, info_id, results: Results):
-        precisions = []
-        recalls = []
-         
-        relevant_docs = self.information_needs[info_id].get_relevant_documents()
-        retrieved_docs = results.get_documents_from_infoNeed(info_id)
-        
-        precision_points = []
-        recall_points = []
-        
-        for index, doc in enumerate(retrieved_docs):
-            if doc in relevant_docs:
-                precision = self.precision(info_id, results, index + 1) 
-                recall = self.recall(info_id, results, index + 1)  
-                
-                precision_points.append(precision)
-                recall_points.append(recall)
-                print(f"Doc: {doc} | Precision: {precision:.3f} | Recall: {recall:.3f}")
-        
-        # Lista de recalls estándar donde interpolaremos las precisiones
-        recall_levels = [i / 10.0 for i in range(11)]
-        
-        # Aplicamos la interpolación de precisión para cada nivel de recall estándar
-        interpolated_precisions = []
-        
-        for recall_level in recall_levels:
-            # Encontrar la máxima precisión para el recall >= recall_level
-            max_precision = 0.0
-            for r, p in zip(recall_points, precision_points):
-                if r >= recall_level:
-                    max_precision = max(max_precision, p)
-            interpolated_precisions.append(max_precision)
-
-        
-        return recall_levels, interpolated_precisions
-    
-
-
-
-
+        return self.evaluate(info_id, results).recall_precision_interpolated()
+
+# Evaluación vectorizada con NumPy de todas las necesidades de información a la vez. Los juicios de relevancia
+# se cargan una única vez y se reutilizan para evaluar tantas ejecuciones (ficheros de resultados) como se quiera:
+# cada ejecución se representa como una matriz necesidades x posiciones con los aciertos (documentos relevantes)
+class BatchEvaluation:
+    def __init__(self, qrels_file_name):
+        qrels = np.loadtxt(qrels_file_name, dtype=np.int64, delimiter='\t', ndmin=2).reshape(-1, 3)
+        needs, docs, relevancy = qrels[:, 0], qrels[:, 1], qrels[:, 2]
+        # identificadores de las necesidades en el orden en que aparecen en qrels
+        unique_ids, first = np.unique(needs, return_index=True)
+        self.need_ids = unique_ids[np.argsort(first)]
+        self.sorted_ids = unique_ids
+        # posición (en el orden de qrels) de cada necesidad de sorted_ids
+        self.order_of_sorted = np.empty(len(unique_ids), dtype=np.int64)
+        self.order_of_sorted[np.argsort(first)] = np.arange(len(unique_ids))
+        # si un documento se juzga varias veces para la misma necesidad prevalece el último juicio
+        keys = self.keys(self.need_positions(needs)[0], docs)
+        last = len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1]
+        relevant = last[relevancy[last] == 1]
+        self.relevant_keys = np.sort(keys[relevant])
+        self.num_relevant = np.bincount(self.need_positions(needs[relevant])[0], minlength=len(self.need_ids))
+
+    # Posición de cada necesidad en el orden de qrels y máscara de las que tienen juicios de relevancia
+    def need_positions(self, needs):
+        index = np.clip(np.searchsorted(self.sorted_ids, needs), 0, max(len(self.sorted_ids) - 1, 0))
+        known = self.sorted_ids[index] == needs if len(self.sorted_ids) else np.zeros(len(needs), dtype=bool)
+        return self.order_of_sorted[index], known
+
+    # Clave única de cada par (necesidad, documento)
+    @staticmethod
+    def keys(need_positions, docs):
+        return (need_positions << 32) | docs
+
+    @staticmethod
+    def load_results(results_file_name):
+        results = np.loadtxt(results_file_name, dtype=np.int64, delimiter='\t', ndmin=2).reshape(-1, 2)
+        return results[:, 0], results[:, 1]
+
+    # Calcula las métricas de todas las necesidades para los resultados dados (necesidad y documento de cada
+    # línea del fichero de resultados, en orden). Devuelve un diccionario de arrays con una fila por necesidad
+    def evaluate(self, result_needs, result_docs):
+        n = len(self.need_ids)
+        positions, known = self.need_positions(result_needs)
+        positions, docs = positions[known], result_docs[known]
+        # agrupamos los resultados por necesidad manteniendo el orden del fichero dentro de cada una
+        order = np.argsort(positions, kind='stable')
+        positions, docs = positions[order], docs[order]
+        num_retrieved = np.bincount(positions, minlength=n)
+        starts = np.cumsum(num_retrieved) - num_retrieved
+        ranks = np.arange(len(positions)) - starts[positions]
+        # matriz de aciertos: hits[i, k] indica si el resultado k de la necesidad i es relevante
+        width = int(num_retrieved.max()) if n else 0
+        hits = np.zeros((n, width), dtype=bool)
+        hits[positions, ranks] = np.isin(self.keys(positions, docs), self.relevant_keys)
+        cumulative_hits = np.cumsum(hits, axis=1)
+
+        rows = np.arange(n)
+        def tp_at(k):
+            return np.where(k > 0, cumulative_hits[rows, np.maximum(k, 1) - 1] if width else 0, 0)
+        tp = tp_at(num_retrieved)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(num_retrieved > 0, tp / num_retrieved, 0.0)
+            recall = np.where(self.num_relevant > 0, tp / self.num_relevant, 0.0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+            prec_at_10 = tp_at(np.minimum(num_retrieved, 10)) / 10
+            # precisión y recall en cada posición de la lista de resultados
+            precision_at = cumulative_hits / np.arange(1, width + 1)
+            recall_at = np.where(self.num_relevant[:, None] > 0, cumulative_hits / self.num_relevant[:, None], 0.0)
+            average_precision = np.where(tp > 0, np.where(hits, precision_at, 0.0).sum(axis=1) / tp, 0.0)
+        # precisión interpolada en los 11 niveles de recall estándar: máxima precisión en los aciertos con recall >= nivel
+        recall_levels = np.arange(11) / 10
+        if width:
+            valid = hits[:, :, None] & (recall_at[:, :, None] >= recall_levels)
+            interpolated = np.where(valid, precision_at[:, :, None], 0.0).max(axis=1)
+        else:
+            interpolated = np.zeros((n, 11))
+        return {'need_ids': self.need_ids, 'precision': precision, 'recall': recall, 'f1': f1,
+                'prec_at_10': prec_at_10, 'average_precision': average_precision, 'hits': hits,
+                'precision_at': precision_at, 'recall_at': recall_at, 'recall_levels': recall_levels,
+                'interpolated': interpolated}
+
+    def evaluate_file(self, results_file_name):
+        return self.evaluate(*self.load_results(results_file_name))
+
+# Escribe el informe de una evaluación por lotes con el mismo formato que la evaluación por necesidad
+def write_batch_report(Outputfile, metrics):
+    num_queries = len(metrics['need_ids'])
+    for i in range(num_queries):
+        Outputfile.write(f"INFORMATION_NEED {i + 1}\n")
+        Outputfile.write(f"precision {metrics['precision'][i]:.3f}\n")
+        Outputfile.write(f"recall {metrics['recall'][i]:.3f}\n")
+        Outputfile.write(f"F1 {metrics['f1'][i]:.3f}\n")
+        Outputfile.write(f"prec@10 {metrics['prec_at_10'][i]:.3f}\n")
+        Outputfile.write(f"average_precision {metrics['average_precision'][i]:.3f}\n")
+        Outputfile.write("recall_precision\n")
+        points = np.flatnonzero(metrics['hits'][i])
+        for recall_value, precision_value in zip(metrics['recall_at'][i, points], metrics['precision_at'][i, points]):
+            Outputfile.write(f"{recall_value:.3f} {precision_value:.3f}\n")
+        Outputfile.write("interpolated_recall_precision\n")
+        for recall_value, precision_value in zip(metrics['recall_levels'], metrics['interpolated'][i]):
+            Outputfile.write(f"{recall_value:.3f} {precision_value:.3f}\n")
+
+    # métricas totales: media de todas las necesidades
+    def mean(values):
+        return values.sum(axis=0) / max(num_queries, 1)
+    Outputfile.write("\nTOTAL\n")
+    Outputfile.write(f"precision {mean(metrics['precision']):.3f}\n")
+    Outputfile.write(f"recall {mean(metrics['recall']):.3f}\n")
+    Outputfile.write(f"F1 {mean(metrics['f1']):.3f}\n")
+    Outputfile.write(f"prec@10 {mean(metrics['prec_at_10']):.3f}\n")
+    Outputfile.write(f"MAP {mean(metrics['average_precision']):.3f}\n")
+    Outputfile.write("interpolated_recall_precision\n")
+    for i, precision_value in enumerate(mean(metrics['interpolated'])):
+        Outputfile.write(f"{i/10:.3f} {precision_value:.3f}\n")
+
+# Modo por lotes: carga los juicios una vez y evalúa todos los ficheros de resultados indicados
+def run_batch(qrelsFileName, resultsFileNames, outputFileName):
+    batch = BatchEvaluation(qrelsFileName)
+    with open(outputFileName, 'w') as Outputfile:
+        for resultsFileName in resultsFileNames:
+            metrics = batch.evaluate_file(resultsFileName)
+            if len(resultsFileNames) > 1:
+                Outputfile.write(f"RESULTS {resultsFileName}\n")
+            write_batch_report(Outputfile, metrics)
+            print(f"{resultsFileName}: MAP {metrics['average_precision'].sum() / max(len(metrics['need_ids']), 1):.3f}")
 
 
 if __name__ == '__main__':
     i = 1
     infor=False
+    batch = False
+    resultsFileNames = []
     while (i < len(sys.argv)):
         if sys.argv[i] == '-qrels': #guarda el indice donde va a hacer la búsqueda
             qrelsFileName = sys.argv[i+1]
             i = i + 1
         if sys.argv[i] == '-results':
             resultsFileName = sys.argv[i+1]   #guarda el fichero que contiene las consultas
+            resultsFileNames.append(resultsFileName)
             i += 1
         if sys.argv[i] == '-output':
             outputFileName = sys.argv[i+1] #guarda el fichero de resultados
             i += 1
+        if sys.argv[i] == '-batch':     #evaluación vectorizada de uno o varios ficheros de resultados
+            batch = True
         i = i + 1
 
+    if batch:
+        run_batch(qrelsFileName, resultsFileNames, outputFileName)
+        sys.exit(0)
+
     evaluation =Evaluation()
     #cargar el archivo qrels.txt
     with open(qrelsFileName, 'r') as Queryfile:
@@ -276,11 +368,13 @@ if __name__ == '__main__':
         for infoNeed in evaluation.information_needs:
             Outputfile.write(f"INFORMATION_NEED {count}\n")
             
-            precision = evaluation.precision(infoNeed, results)
-            recall = evaluation.recall(infoNeed, results, len(results.get_documents_from_infoNeed(infoNeed)))
-            f1 = evaluation.f1(infoNeed, results)
-            prec_at_10 = evaluation.prec10(infoNeed, results)
-            average_precision = evaluation.average_precision(infoNeed, results)
+            # todas las métricas de la necesidad se obtienen de una única pasada por sus resultados
+            need_evaluation = evaluation.evaluate(infoNeed, results)
+            precision = need_evaluation.precision()
+            recall = need_evaluation.recall()
+            f1 = need_evaluation.f1()
+            prec_at_10 = need_evaluation.prec10()
+            average_precision = need_evaluation.average_precision()
             
             Outputfile.write(f"precision {precision:.3f}\n")
             Outputfile.write(f"recall {recall:.3f}\n")
@@ -297,12 +391,12 @@ if __name__ == '__main__':
             
             # Recall y Precision
             Outputfile.write("recall_precision\n")
-            precisions, recalls = evaluation.recall_precision(infoNeed, results)
+            precisions, recalls = need_evaluation.recall_precision()
             for recall_value, precision_value in zip(recalls, precisions):
                 Outputfile.write(f"{recall_value:.3f} {precision_value:.3f}\n")
             
             # Interpolación de precisión y recall
-            interpolated_recalls, interpolated_precisions[count-1] = evaluation.recall_precision_interpolated(infoNeed, results)
+            interpolated_recalls, interpolated_precisions[count-1] = need_evaluation.recall_precision_interpolated()
             Outputfile.write("interpolated_recall_precision\n")
             for recall_value, precision_value in zip(interpolated_recalls, interpolated_precisions[count-1]):
                 Outputfile.write(f"{recall_value:.3f} {precision_value:.3f}\n")
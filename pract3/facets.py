@@ -0,0 +1,93 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+facets.py
+Authors: Carlos Giralt and Berta Olano
+
+
+Faceted counts (docType, language, publishingyear and department) of the results of search.py. Every facet field is
+turned once per generation of the index into doc-value arrays: the docnum and the value code of every (document,
+value) pair, plus the label of each code. The numeric fields come from the columns of column_store.py when they
+exist. MatchSetCollector records every matching document in the same pass over the postings that scores the top
+results, so the counts of all the facets are a lookup of the matching documents in those arrays and a bincount per
+field, with no extra queries.
+"""
+import numpy as np
+from whoosh.collectors import WrappingCollector
+from whoosh.fields import NUMERIC
+
+from column_store import MISSING_INT, numeric_column
+
+FACET_FIELDS = ('docType', 'language', 'publishingyear', 'department')
+
+# Collector de Whoosh que, además de los resultados del collector hijo, guarda el docnum de todos los documentos que
+# cumplen la query. El hijo no debe podar documentos: se crea con optimize=False y no se le deja sustituir el matcher
+# por uno que descarte los documentos que ya no pueden entrar entre los primeros
+class MatchSetCollector(WrappingCollector):
+    def __init__(self, child):
+        self.child = child
+        child.replace = 0
+        self.docnums = []
+
+    def collect_matches(self):
+        child = self.child
+        offset = child.offset
+        docnums = self.docnums
+        for sub_docnum in child.matches():
+            docnums.append(offset + sub_docnum)
+            child.collect(sub_docnum)
+
+# Valores de un campo como arrays paralelos docnum -> código del valor, y la etiqueta de cada código
+class FacetField:
+    def __init__(self, labels, docnums, codes):
+        self.labels = labels
+        self.docnums = docnums
+        self.codes = codes
+
+    # Recuento de cada valor entre los documentos marcados en matched (array booleano indexado por docnum), de mayor
+    # a menor; los valores sin documentos no aparecen
+    def counts(self, matched):
+        counts = np.bincount(self.codes[matched[self.docnums]], minlength=len(self.labels))
+        order = np.lexsort((np.arange(len(counts)), -counts))
+        return [(self.labels[code], int(counts[code])) for code in order if counts[code]]
+
+# Campo KEYWORD: un código por término, con los documentos de sus postings (un documento puede tener varios valores)
+def keyword_field(reader, fieldname):
+    labels, docnums, codes = [], [], []
+    for term in reader.lexicon(fieldname):
+        ids = np.fromiter(reader.postings(fieldname, term).all_ids(), dtype=np.int64)
+        docnums.append(ids)
+        codes.append(np.full(len(ids), len(labels), dtype=np.int64))
+        labels.append(term.decode('utf-8'))
+    if not labels:
+        return FacetField([], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    return FacetField(labels, np.concatenate(docnums), np.concatenate(codes))
+
+# Campo NUMERIC entero a partir de su columna: un código por valor distinto, ignorando los documentos sin valor
+def numeric_field(column):
+    column = np.asarray(column)
+    docnums = np.flatnonzero(column != MISSING_INT)
+    values, codes = np.unique(column[docnums], return_inverse=True)
+    return FacetField([int(value) for value in values], docnums, codes)
+
+class FacetIndex:
+    # columns: ColumnStore del índice (None para leer los campos numéricos de los postings)
+    def __init__(self, reader, schema, columns=None, fieldnames=FACET_FIELDS):
+        self.doc_count = reader.doc_count_all()
+        self.fields = {}
+        for fieldname in fieldnames:
+            if fieldname not in schema:
+                continue
+            if isinstance(schema[fieldname], NUMERIC):
+                if columns is not None and fieldname in columns:
+                    column = columns[fieldname]
+                else:
+                    column = numeric_column(reader, schema, fieldname)
+                self.fields[fieldname] = numeric_field(column)
+            else:
+                self.fields[fieldname] = keyword_field(reader, fieldname)
+
+    # Recuentos de todas las facetas de un conjunto de documentos: {campo: [(valor, documentos), ...]}
+    def counts(self, docnums):
+        matched = np.zeros(self.doc_count, dtype=bool)
+        matched[np.asarray(docnums, dtype=np.int64)] = True
+        return {fieldname: field.counts(matched) for fieldname, field in self.fields.items()}
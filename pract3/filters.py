@@ -0,0 +1,71 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+filters.py
+Authors: Carlos Giralt and Berta Olano
+
+
+Whoosh query over a fixed set of documents, shared by search.py (filter-first execution of the structured clauses)
+and searchNoEvaluable.py (candidate documents of a spatial: query). FilterQuery takes the sorted global docnums of the
+set as a NumPy array and matches them in every segment with a ListMatcher, either without score (ZeroScorer) or with
+the same constant score for all of them. It only depends on Whoosh and NumPy.
+"""
+from array import array
+
+import numpy as np
+from whoosh.matching import ListMatcher
+from whoosh.query import Query
+from whoosh.scoring import WeightScorer, BaseScorer
+
+# Scorer que no suma nada a la puntuación (cota de calidad 0)
+class ZeroScorer(BaseScorer):
+    def supports_block_quality(self):
+        return True
+
+    def score(self, matcher):
+        return 0.0
+
+    def max_quality(self):
+        return 0.0
+
+    def block_quality(self, matcher):
+        return 0.0
+
+# Filtro sobre un conjunto fijo de documentos (array de NumPy ordenado con los números de documento globales) que no
+# puntúa, o que da a todos sus documentos la puntuación score. Al formar parte del And, la intersección solo avanza
+# por los documentos del filtro en vez de comprobarlos tras encontrar cada documento, como hace el parámetro filter
+# de Whoosh
+class FilterQuery(Query):
+    def __init__(self, docs, score=0.0):
+        self.docs = np.asarray(docs, dtype=np.int64)
+        self.score = score
+        self.boost = 1.0
+
+    def __eq__(self, other):
+        return other.__class__ is self.__class__ and other.docs is self.docs and other.score == self.score
+
+    def __hash__(self):
+        return id(self.docs)
+
+    def __unicode__(self):
+        return f"<filtro de {len(self.docs)} documentos>"
+
+    __str__ = __unicode__
+
+    def is_leaf(self):
+        return True
+
+    def estimate_size(self, ixreader):
+        return len(self.docs)
+
+    def matcher(self, searcher, context=None):
+        # los documentos del filtro son globales: si el índice tiene varios segmentos, se toma con dos búsquedas
+        # binarias el tramo del array que cae en el segmento y se pasa a números de documento del segmento
+        offset = 0
+        parent = searcher.get_parent()
+        if parent is not searcher:
+            offset = next(subOffset for subsearcher, subOffset in parent.subsearchers if subsearcher is searcher)
+        start, end = np.searchsorted(self.docs, [offset, offset + searcher.doc_count_all()])
+        ids = array("I", (self.docs[start:end] - offset).astype(np.uint32).tobytes())
+        if not self.score:
+            return ListMatcher(ids, scorer=ZeroScorer())
+        return ListMatcher(ids, all_weights=self.score, scorer=WeightScorer(self.score))
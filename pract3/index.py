@@ -5,18 +5,27 @@ Authors: Carlos Giralt and Berta Olano
 
 
 Simple program to create an inverted index with the contents of text/xml files contained in a docs folder
+(or read directly from a ZIP/tar(.gz) archive or from a single XML harvest dump).
 This program is based on the whoosh library. See https://pypi.org/project/Whoosh/ .
-Usage: python3 index.py -docs <docsPath> ../dublinCore -index <indexPath>
+Usage: python3 index.py -docs <docsPath> ../dublinCore -index <indexPath> [-procs <numProcesses>] [-update]
+       [-limitmb <writerMemoryMB>] [-commitEvery <numDocuments>] [-merge default|optimize|none]
 """
 
-from whoosh.index import create_in
+from whoosh.index import create_in, open_dir, exists_in
 from whoosh.fields import *
 from whoosh.analysis import LanguageAnalyzer
-from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, StemFilter
-from custom_filters import CustomSpanishStemmingFilter
+from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, StemFilter, StripFilter
+from custom_filters import CustomSpanishStemmingFilter, stem_cache_info
+from column_store import write_columns
 
 
 import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from multiprocessing import Pool
 
 import xml.etree.ElementTree as ET
 import email.utils
@@ -25,6 +34,11 @@ LANGUAGE = 'spanish'
 
 ns= {'dc':'http://purl.org/dc/elements/1.1/','ows':'http://www.opengis.net/ows'}   #definimos el espacio de nombres
 
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')    #archivos que se indexan sin descomprimirlos en disco
+# Campos numéricos que se guardan además como columnas (column_store.py)
+NUMERIC_COLUMNS = ('publishingyear',)
+MERGE_POLICIES = ('default', 'optimize', 'none')    #política de fusión de segmentos en el commit final
+
 
 #creamos nuestro propio analizador de texto en español
 def CustomSpanishAnalyzer():
@@ -33,91 +47,365 @@ def CustomSpanishAnalyzer():
             StopFilter(lang="es") |            # Paso 3: Filtro de palabras vacías en español
             CustomSpanishStemmingFilter())     # Paso 4: Stemming personalizado
 
+# analizador del campo department: un término por línea, ya que los nombres de departamento no contienen saltos de
+# línea (sí comas, p. ej. "Departamento de Medicina, Psiquiatría y Dermatología")
+def DepartmentAnalyzer():
+    return RegexTokenizer(r"[^\n]+") | StripFilter()
+
 # crea un directorio si no existe ya
 def create_folder(folder_name):
     if (not os.path.exists(folder_name)):
         os.mkdir(folder_name)
 
+# Recorre un fichero XML (ruta o fichero abierto) en una única pasada con iterparse y devuelve, por cada registro,
+# un diccionario campo Dublin Core -> lista de textos. Un registro es cualquier elemento con hijos dc:*, por lo que
+# sirve tanto para ficheros con un único registro como para volcados con muchos registros (p. ej. OAI-PMH ListRecords).
+# Cada elemento se libera en cuanto termina, de modo que la memoria no depende del tamaño del fichero
+def iter_records(source):
+    dc_prefix = '{' + ns['dc'] + '}'
+    stack = []      # pila de (elemento abierto, campos dc:* de sus hijos)
+    found = False
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append((elem, {}))
+            continue
+        elem, fields = stack.pop()
+        if elem.tag.startswith(dc_prefix) and stack:
+            stack[-1][1].setdefault(elem.tag[len(dc_prefix):], []).append(elem.text)
+        elif fields:
+            found = True
+            yield fields
+        elem.clear()
+        if stack:
+            stack[-1][0].remove(elem)
+    if not found:
+        yield {}    # un fichero sin campos Dublin Core se indexa como un documento vacío
+
 # busca en el campo especificado en parameter
-def find_parameter(root, parameter):
-    aux = root.findall('dc:'+parameter, ns)
-    matches = " ".join([match.text for match in aux if match.text is not None])
+def find_parameter(record, parameter):
+    aux = record.get(parameter, [])
+    matches = " ".join([text for text in aux if text is not None])
     return matches
 
-#encontrar búsquedas en el campo departamento
-def find_publisher(root):
-    publishers = root.findall('dc:publisher', ns)
+#encontrar los departamentos del campo publisher
+def find_departments(record):
+    publishers = record.get('publisher', [])
     departments = [] # Lista para almacenar los departamentos encontrados
     for publisher in publishers:
-        if publisher.text:
+        if publisher:
             # Dividir el texto por ';' para separar las partes
-            parts = publisher.text.split(';')
+            parts = publisher.split(';')
             for part in parts:
                 part = part.strip()  # Eliminar espacios alrededor de cada parte
                 if part.startswith("Departamento"):
                     departments.append(part)  # Agregar el departamento a la lista   
-    # Concatenar todos los departamentos encontrados, uno por línea
-    return " ".join(departments)
+    return departments
+
+#encontrar búsquedas en el campo departamento
+def find_publisher(record):
+    # Concatenar todos los departamentos encontrados
+    return " ".join(find_departments(record))
+
+#departamentos separados por saltos de línea, un valor del campo KEYWORD department (faceta) por departamento
+def find_department(record):
+    return "\n".join(" ".join(department.split()) for department in find_departments(record))
 
 #encontrar búsquedas en el campo año de publicación
-def find_Publishingyear(root):
-    dates = root.findall('dc:date', ns)
-    if dates and dates[0].text is not None:
+def find_Publishingyear(record):
+    dates = record.get('date', [])
+    if dates and dates[0] is not None:
         try:
             # Intentamos extraer solo el año si es un valor numérico
-            return int(dates[0].text[:4])
+            return int(dates[0][:4])
         except ValueError:
             return None  # Si no es un número válido, devolvemos None
     return None  # Si no se encuentra un año
  
 
+# fecha de última modificación del fichero, en el mismo formato en el que se almacena en el campo date
+def file_date(file_path):
+    d=os.path.getmtime(file_path)   #extraemos última fecha de modificación
+    return email.utils.formatdate(d, usegmt=False)  #formateamos la fecha
+
+# Recorre los ficheros .xml/.txt de un archivo ZIP o tar(.gz) sin extraerlos a disco. Devuelve, para cada uno,
+# su nombre dentro del archivo, su fecha formateada y una función que abre su contenido. Los tar se leen en modo
+# flujo, por lo que cada entrada debe procesarse antes de pasar a la siguiente
+def iter_archive(archive_path):
+    if archive_path.endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.endswith(('.xml', '.txt')):
+                    d = time.mktime(info.date_time + (0, 0, -1))
+                    yield info.filename, email.utils.formatdate(d, usegmt=False), lambda info=info: archive.open(info)
+    else:
+        with tarfile.open(archive_path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(('.xml', '.txt')):
+                    fecha_formateada = email.utils.formatdate(member.mtime, usegmt=False)
+                    yield member.name, fecha_formateada, lambda member=member: archive.extractfile(member)
+
+# máximo de memoria residente (RSS) alcanzado por el proceso, en MB (ru_maxrss está en bytes en macOS y en KB en Linux).
+# Con children=True, el de los procesos hijos ya terminados (el mayor de ellos, p. ej. los del pool de -procs).
+# El módulo resource solo existe en Unix: en Windows devuelve None
+def peak_rss_mb(children=False):
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def format_mb(megabytes):
+    return 'no disponible' if megabytes is None else f"{megabytes:.1f} MB"
+
+# divide la lista de ficheros en n bloques contiguos, conservando el orden original
+def split_in_chunks(files, n):
+    size, extra = divmod(len(files), n)
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            chunks.append(files[start:end])
+        start = end
+    return chunks
+
+# indexa un bloque de ficheros en un índice temporal propio. Se ejecuta en cada proceso del pool,
+# de modo que el parseo del XML y el análisis de los campos de texto se reparten entre procesos.
+# Devuelve también la caché de stemming del proceso, ya que el stemming se hace en él y no en el principal
+def index_chunk(args):
+    chunk_folder, docs_folder, files, limitmb = args
+    my_index = MyIndex(chunk_folder, limitmb=limitmb)
+    for file in files:
+        my_index.index_file(docs_folder, file)
+    my_index.commit()
+    return chunk_folder, tuple(stem_cache_info())
+
+
 class MyIndex:
-    def __init__(self, index_folder):
+    # limitmb: memoria máxima del writer antes de volcar a disco; commit_every: commit intermedio cada N documentos
+    # (0 = un único commit al final); merge_policy: fusión de segmentos en el commit final (ver MERGE_POLICIES)
+    def __init__(self, index_folder, update=False, limitmb=128, commit_every=0, merge_policy='default'):
         schema = Schema(path=ID(stored=True), date=STORED, title=TEXT(analyzer=CustomSpanishAnalyzer()), 
                         subject=TEXT(analyzer=CustomSpanishAnalyzer()), description=TEXT(analyzer=CustomSpanishAnalyzer()), 
                         creator=TEXT(analyzer=CustomSpanishAnalyzer()), contributor=TEXT(analyzer=CustomSpanishAnalyzer()),
                         publisher=TEXT(analyzer=CustomSpanishAnalyzer()), 
-                        publishingyear=NUMERIC(numtype=int), identifier=TEXT(stored=True), docType=KEYWORD(lowercase=True), language=KEYWORD)
+                        publishingyear=NUMERIC(numtype=int), identifier=TEXT(stored=True), docType=KEYWORD(lowercase=True), language=KEYWORD,
+                        department=KEYWORD(analyzer=DepartmentAnalyzer()))
         create_folder(index_folder)
-        index = create_in(index_folder, schema)
-        self.writer = index.writer()
+        # en modo actualización se reutiliza el índice existente en lugar de crearlo de nuevo
+        self.update = update and exists_in(index_folder)
+        if self.update:
+            index = open_dir(index_folder)
+        else:
+            index = create_in(index_folder, schema)
+        self.index = index
+        self.limitmb = limitmb
+        self.commit_every = commit_every
+        self.merge_policy = merge_policy
+        self.doc_count = 0          # documentos añadidos en esta ejecución
+        self.pending = 0            # documentos añadidos desde el último commit
+        self.commits = 0
+        self.commit_time = 0.0
+        self.worker_stem_info = []  # caché de stemming de cada proceso de indexado en paralelo
+        self.writer = index.writer(limitmb=limitmb)
+        # los índices creados con un esquema anterior reciben los campos nuevos (p. ej. department) al actualizarlos,
+        # y entonces se reindexan todos los documentos para que ninguno quede sin ellos
+        self.new_fields = [fieldname for fieldname, _ in schema.items() if fieldname not in index.schema]
+        for fieldname in self.new_fields:
+            self.writer.add_field(fieldname, schema[fieldname])
+        if self.new_fields:
+            print(f"Campos nuevos en el esquema: {', '.join(self.new_fields)}; se reindexan todos los documentos")
+
+    # añade un documento y hace un commit intermedio cada commit_every documentos, de modo que la memoria del
+    # writer no crece sin límite y un fallo solo pierde los documentos del último bloque
+    def add_document(self, **fields):
+        self.writer.add_document(**fields)
+        self.added(1)
+
+    def added(self, num_docs):
+        self.doc_count += num_docs
+        self.pending += num_docs
+        if self.commit_every and self.pending >= self.commit_every:
+            self.commit(merge=False)
+            self.writer = self.index.writer(limitmb=self.limitmb)
+
+    def commit(self, **kwargs):
+        start = time.time()
+        self.writer.commit(**kwargs)
+        self.commit_time += time.time() - start
+        self.commits += 1
+        self.pending = 0
 
-    def index_docs(self, docs_folder):   #indexa documentos
-        if (os.path.exists(docs_folder)):
-            for file in sorted(os.listdir(docs_folder)):
+    # commit final según la política de fusión elegida
+    def finish(self):
+        if self.merge_policy == 'optimize':
+            self.commit(optimize=True)     # fusiona todos los segmentos en uno
+        elif self.merge_policy == 'none':
+            self.commit(merge=False)       # deja los segmentos tal cual (commit más rápido)
+        else:
+            self.commit()                  # fusión por defecto de Whoosh de los segmentos pequeños
+        # columnas de los campos numéricos, indexadas por docnum, para los searchers
+        write_columns(self.index, NUMERIC_COLUMNS)
+
+    # número de segmentos del índice tras el último commit
+    def segment_count(self):
+        with self.index.reader() as reader:
+            return len(list(reader.leaf_readers()))
+
+    # aciertos, fallos y raíces en caché de la caché de stemming, sumando las de los procesos de indexado en paralelo
+    def stem_cache_summary(self):
+        info = stem_cache_info()
+        hits, misses, currsize = info.hits, info.misses, info.currsize
+        for worker_hits, worker_misses, _, worker_currsize in self.worker_stem_info:
+            hits += worker_hits
+            misses += worker_misses
+            currsize += worker_currsize
+        return hits, misses, currsize
+
+    def summary(self, elapsed):
+        docs_per_sec = self.doc_count / elapsed if elapsed > 0 else 0.0
+        print(f"Documentos indexados: {self.doc_count} en {elapsed:.2f} s ({docs_per_sec:.1f} docs/s)")
+        memory = f"pico de memoria (RSS): {format_mb(peak_rss_mb())}"
+        if self.worker_stem_info:
+            memory += f" en el proceso principal, {format_mb(peak_rss_mb(children=True))} en el mayor de los procesos de indexado"
+        print(f"Commits: {self.commits} ({self.commit_time:.2f} s), segmentos: {self.segment_count()}, {memory}")
+        hits, misses, currsize = self.stem_cache_summary()
+        processes = f" (suma de {len(self.worker_stem_info)} procesos)" if self.worker_stem_info else ""
+        print(f"Caché de stemming{processes}: {hits} aciertos, {misses} fallos, {currsize} raíces en caché")
+
+    def index_docs(self, docs_folder, procs=1):   #indexa documentos
+        if os.path.isdir(docs_folder):
+            files = [file for file in sorted(os.listdir(docs_folder)) if file.endswith('.xml') or file.endswith('.txt')]
+            self.index_files(docs_folder, files, procs)
+        elif docs_folder.endswith(ARCHIVE_EXTENSIONS):
+            self.index_archive(docs_folder)
+        elif os.path.isfile(docs_folder):
+            # un único fichero, p. ej. un volcado OAI-PMH ListRecords con muchos registros
+            self.index_files(os.path.dirname(docs_folder), [os.path.basename(docs_folder)], procs)
+        self.finish()
+
+    def index_files(self, docs_folder, files, procs):
+        if self.update:
+            files = self.changed_files(docs_folder, files)
+        if procs > 1 and len(files) > 1:
+            self.index_docs_parallel(docs_folder, files, procs)
+        else:
+            for file in files:
                 # print(file)
-                if file.endswith('.xml'):
-                    self.index_xml_doc(docs_folder, file)
-                elif file.endswith('.txt'):
-                    self.index_txt_doc(docs_folder, file)
-        self.writer.commit()
+                self.index_file(docs_folder, file)
+
+    # indexa las entradas de un archivo ZIP o tar(.gz) leyéndolas directamente del archivo (siempre en serie).
+    # En modo actualización solo se leen las entradas nuevas o cuya fecha ha cambiado
+    def index_archive(self, archive_path):
+        indexed = self.indexed_dates() if self.update else {}
+        seen = set()
+        changed = 0
+        for name, fecha_formateada, open_member in iter_archive(archive_path):
+            seen.add(name)
+            if name in indexed:
+                if indexed[name] == fecha_formateada:
+                    continue
+                self.writer.delete_by_term('path', name)    # entrada modificada
+            changed += 1
+            with open_member() as member:
+                if name.endswith('.xml'):
+                    for record in iter_records(member):
+                        self.index_record(name, fecha_formateada, record)
+                else:
+                    self.add_document(path=name, date=fecha_formateada)
+        deleted = [path for path in indexed if path not in seen]
+        for path in deleted:
+            self.writer.delete_by_term('path', path)        # entrada eliminada
+        if self.update:
+            print(f"Actualización: {changed} ficheros nuevos o modificados, {len(deleted)} eliminados")
+
+    # fecha de los documentos ya indexados, por path. Si el esquema tiene campos nuevos, las fechas se ignoran (None),
+    # de modo que todos los documentos cuentan como modificados
+    def indexed_dates(self):
+        indexed = {}
+        with self.index.searcher() as searcher:
+            for fields in searcher.all_stored_fields():
+                indexed[fields['path']] = None if self.new_fields else fields.get('date')
+        return indexed
+
+    # compara los ficheros de la carpeta con los documentos ya indexados (campos path y date): elimina del índice
+    # los documentos borrados o modificados y devuelve los ficheros que hay que (re)indexar
+    def changed_files(self, docs_folder, files):
+        indexed = self.indexed_dates()
+        changed = []
+        deleted = 0
+        present = set(files)
+        for path in indexed:
+            if path not in present:
+                self.writer.delete_by_term('path', path)    # fichero eliminado
+                deleted += 1
+        for file in files:
+            if file not in indexed:
+                changed.append(file)                        # fichero nuevo
+            elif indexed[file] != file_date(os.path.join(docs_folder, file)):
+                self.writer.delete_by_term('path', file)    # fichero modificado
+                changed.append(file)
+        print(f"Actualización: {len(changed)} ficheros nuevos o modificados, {deleted} eliminados")
+        return changed
+
+    # indexado en paralelo: cada proceso construye el segmento de un bloque contiguo de ficheros y después
+    # se fusionan en orden en el índice final, por lo que los números de documento coinciden con el indexado en serie
+    def index_docs_parallel(self, docs_folder, files, procs):
+        tmp_folder = tempfile.mkdtemp(prefix='whoosh_chunks_')
+        try:
+            chunks = split_in_chunks(files, procs)
+            tasks = [(os.path.join(tmp_folder, str(n)), docs_folder, chunk, self.limitmb) for n, chunk in enumerate(chunks)]
+            with Pool(processes=procs) as pool:
+                chunk_results = pool.map(index_chunk, tasks)
+            for chunk_folder, stem_info in chunk_results:
+                self.worker_stem_info.append(stem_info)
+                reader = open_dir(chunk_folder).reader()
+                self.writer.add_reader(reader)
+                num_docs = reader.doc_count()
+                reader.close()
+                self.added(num_docs)
+        finally:
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    def index_file(self, foldername, filename):
+        if filename.endswith('.xml'):
+            self.index_xml_doc(foldername, filename)
+        elif filename.endswith('.txt'):
+            self.index_txt_doc(foldername, filename)
 
     def index_txt_doc(self, foldername, filename):   #para ficheros .txt
         file_path = os.path.join(foldername, filename)
         # print(file_path)
-        d=os.path.getmtime(file_path)
-        fecha_formateada = email.utils.formatdate(d, usegmt=False)
-        self.writer.add_document(path=filename, date=fecha_formateada)
+        fecha_formateada = file_date(file_path)
+        self.add_document(path=filename, date=fecha_formateada)
 
 
     def index_xml_doc(self, foldername, filename):  #para ficheros .xml
         file_path = os.path.join(foldername, filename)
         # print(file_path)
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        d=os.path.getmtime(file_path)   #extraemos última fecha de modificación
-        fecha_formateada = email.utils.formatdate(d, usegmt=False)  #formateamos la fecha
-        self.writer.add_document(path=filename, date=fecha_formateada, title=find_parameter(root, 'title'),
-                                 subject=find_parameter(root, "subject"), description=find_parameter(root, "description"), creator=find_parameter(root, "creator"),
-                                 contributor=find_parameter(root, "contributor"), publisher=find_publisher(root),
-                                 publishingyear=find_Publishingyear(root), identifier=find_parameter(root, "identifier"), docType=find_parameter(root, "type"),
-                                 language=find_parameter(root, "language"))
+        fecha_formateada = file_date(file_path)
+        # un documento por registro; todos comparten el path del fichero (así -update los sustituye juntos)
+        for record in iter_records(file_path):
+            self.index_record(filename, fecha_formateada, record)
+
+    def index_record(self, path, fecha_formateada, record):  #para cada registro Dublin Core
+        self.add_document(path=path, date=fecha_formateada, title=find_parameter(record, 'title'),
+                          subject=find_parameter(record, "subject"), description=find_parameter(record, "description"), creator=find_parameter(record, "creator"),
+                          contributor=find_parameter(record, "contributor"), publisher=find_publisher(record),
+                          publishingyear=find_Publishingyear(record), identifier=find_parameter(record, "identifier"), docType=find_parameter(record, "type"),
+                          language=find_parameter(record, "language"), department=find_department(record))
 
 if __name__ == '__main__':
 
     index_folder = '../whooshindexZaguan'   #valor por defecto de la carpeta de indexación
     #docs_folder = '../dublinCore'         #valor por defecto de la carpeta de documentos DublinCore
     docs_folder = '../../recordsdc'         #valor por defecto de la carpeta de documentos del repertorio de Zaguan
+    procs = 1                               #número de procesos de indexado (1 = indexado en serie)
+    update = False                          #actualizar solo los ficheros nuevos, modificados o eliminados
+    limitmb = 128                           #memoria máxima del writer (MB)
+    commit_every = 0                        #commit intermedio cada N documentos (0 = solo al final)
+    merge_policy = 'default'                #fusión de segmentos en el commit final
     i = 1
     while i < len(sys.argv):
         if sys.argv[i] == '-index':
@@ -126,9 +414,28 @@ if __name__ == '__main__':
         elif sys.argv[i] == '-docs':
             docs_folder = sys.argv[i + 1]
             i = i + 1
+        elif sys.argv[i] == '-procs':
+            procs = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-update':
+            update = True
+        elif sys.argv[i] == '-limitmb':
+            limitmb = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-commitEvery':
+            commit_every = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-merge':
+            merge_policy = sys.argv[i + 1]
+            if merge_policy not in MERGE_POLICIES:
+                print(f"Política de fusión no válida: {merge_policy} (opciones: {', '.join(MERGE_POLICIES)})")
+                sys.exit(1)
+            i = i + 1
         i = i + 1
 
-    my_index = MyIndex(index_folder)
-    my_index.index_docs(docs_folder)
+    start = time.time()
+    my_index = MyIndex(index_folder, update, limitmb, commit_every, merge_policy)
+    my_index.index_docs(docs_folder, procs)
+    my_index.summary(time.time() - start)
 
 
@@ -14,6 +14,9 @@ from whoosh.fields import *
 from whoosh.analysis import LanguageAnalyzer
 from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, StemFilter
 from custom_filters import CustomSpanishStemmingFilter
+from spatial_index import SpatialIndex
+from column_store import write_columns
+from index_version import index_version
 
 
 import os
@@ -131,6 +134,9 @@ def find_identifier(root):
     return text  
  
 
+# Campos numéricos que se guardan además como columnas (column_store.py)
+NUMERIC_COLUMNS = ('publishingyear', 'west', 'south', 'east', 'north')
+
 class MyIndex:
     def __init__(self,index_folder):
         schema = Schema(path=ID(stored=True), content=TEXT(CustomSpanishAnalyzer()), date=STORED,
@@ -141,7 +147,10 @@ class MyIndex:
                         north=NUMERIC(numtype=float),south=NUMERIC(numtype=float),west=NUMERIC(numtype=float),east=NUMERIC(numtype=float))
         create_folder(index_folder)
         index = create_in(index_folder, schema)
+        self.index_folder = index_folder
+        self.index = index
         self.writer = index.writer()
+        self.boxes = []     # (path, (oeste, sur, este, norte)) de los documentos con BoundingBox
 
     def index_docs(self,docs_folder):   #indexa documentos
         if (os.path.exists(docs_folder)):
@@ -152,6 +161,16 @@ class MyIndex:
                 elif file.endswith('.txt'):
                     self.index_txt_doc(docs_folder, file)
         self.writer.commit()
+        self.save_spatial_index()
+        write_columns(self.index, NUMERIC_COLUMNS)
+
+    # Construye el índice espacial (R-tree) de las cajas de los documentos indexados y lo guarda junto al índice
+    def save_spatial_index(self):
+        with self.index.searcher() as searcher:
+            docnums = {fields['path']: docnum for docnum, fields in searcher.reader().iter_docs()}
+        spatial_index = SpatialIndex([box for _, box in self.boxes], [docnums[path] for path, _ in self.boxes],
+                                     index_version(self.index))
+        spatial_index.save(self.index_folder)
 
     def index_txt_doc(self, foldername,filename):   #para ficheros .txt
         file_path = os.path.join(foldername, filename)
@@ -177,6 +196,8 @@ class MyIndex:
         fecha_formateada = email.utils.formatdate(d, usegmt=False)  #formateamos la fecha
         north,south,west,east=find_Coordinates(root)
         print(f' Norte: {north}, Sur: {south}, este:{east}, oeste:{west}')
+        if None not in (north, south, west, east):
+            self.boxes.append((filename, (west, south, east, north)))
         self.writer.add_document(path=filename, content=text, date=fecha_formateada,title=find_title(root),
                                  subject=find_subject(root),description=find_description(root),creator=find_creator(root),
                                  contributor=find_contributor(root), publisher=find_publisher(root),
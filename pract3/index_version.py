@@ -0,0 +1,14 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+index_version.py
+Authors: Carlos Giralt and Berta Olano
+
+
+Version of a Whoosh index, shared by the structures saved next to it (result cache, numeric columns, spatial R-tree
+and sparse matrices) to tell whether they were built for the current contents of the index.
+"""
+
+# Versión del índice: generación y fecha del último commit. Cambia con cada commit, incluido el de un índice creado de
+# nuevo (cuya generación vuelve a empezar)
+def index_version(index):
+    return f"{index.latest_generation()}-{index.last_modified()}"
@@ -0,0 +1,115 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+instrumentation.py
+Authors: Carlos Giralt and Berta Olano
+
+
+Opt-in instrumentation of search.py. Every processed information need gets a record with the time spent in each
+stage of parseQuery and in the Whoosh search, plus counters (clauses of the final And, sum of the document frequencies
+of the query terms, hits). Records can be exported as JSON lines or as Prometheus text. When instrumentation is
+disabled MySearcher uses NULL_INSTRUMENTATION, whose timers and counters do nothing.
+"""
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+# Instrumentación desactivada: los timers son un único context manager vacío compartido y los contadores no hacen nada
+class NullInstrumentation:
+    enabled = False
+    _null_timer = nullcontext()
+
+    def query(self, query_id):
+        return self._null_timer
+
+    def timer(self, name):
+        return self._null_timer
+
+    def count(self, name, value=1):
+        pass
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+# Valor de una etiqueta en el formato de texto de Prometheus: se escapan la barra invertida, las comillas dobles y los
+# saltos de línea
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Instrumentation:
+    enabled = True
+
+    def __init__(self):
+        self.records = []
+        self.current = None
+
+    # Abre el registro de una necesidad de información; las medidas tomadas dentro del bloque se guardan en él
+    @contextmanager
+    def query(self, query_id):
+        record = {'query': query_id, 'timings': {}, 'counters': {}}
+        previous, self.current = self.current, record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['timings']['total'] = time.perf_counter() - start
+            self.current = previous
+            self.records.append(record)
+
+    # Mide el tiempo del bloque y lo acumula en la etapa name del registro actual
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.current is not None:
+                timings = self.current['timings']
+                timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        if self.current is not None:
+            counters = self.current['counters']
+            counters[name] = counters.get(name, 0) + value
+
+    # Añade registros tomados en otro proceso (búsqueda con -workers)
+    def add_record(self, record):
+        if record is not None:
+            self.records.append(record)
+
+    def to_json_lines(self):
+        return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in self.records)
+
+    # Formato de texto de Prometheus: totales por etapa y contador, y el tiempo y la suma de las frecuencias de
+    # documento de los términos de cada necesidad para localizar las más costosas
+    def to_prometheus(self):
+        stage_sum, stage_count, counter_sum = {}, {}, {}
+        for record in self.records:
+            for name, seconds in record['timings'].items():
+                stage_sum[name] = stage_sum.get(name, 0.0) + seconds
+                stage_count[name] = stage_count.get(name, 0) + 1
+            for name, value in record['counters'].items():
+                counter_sum[name] = counter_sum.get(name, 0) + value
+        lines = ["# HELP pract3_stage_seconds Time spent in each stage of the query processing",
+                 "# TYPE pract3_stage_seconds summary"]
+        for name in stage_sum:
+            lines.append(f'pract3_stage_seconds_sum{{stage="{label_value(name)}"}} {stage_sum[name]:.6f}')
+            lines.append(f'pract3_stage_seconds_count{{stage="{label_value(name)}"}} {stage_count[name]}')
+        for name, value in counter_sum.items():
+            lines.append(f"# TYPE pract3_{name}_total counter")
+            lines.append(f"pract3_{name}_total {value}")
+        lines.append("# HELP pract3_query_seconds Total processing time of each information need")
+        lines.append("# TYPE pract3_query_seconds gauge")
+        for record in self.records:
+            lines.append(f'pract3_query_seconds{{query="{label_value(record["query"])}"}} '
+                         f'{record["timings"]["total"]:.6f}')
+        lines.append("# HELP pract3_query_doc_frequency Sum of the document frequencies of the terms of each "
+                     "information need (total length of their posting lists)")
+        lines.append("# TYPE pract3_query_doc_frequency gauge")
+        for record in self.records:
+            lines.append(f'pract3_query_doc_frequency{{query="{label_value(record["query"])}"}} '
+                         f'{record["counters"].get("doc_frequency", 0)}')
+        return "\n".join(lines) + "\n"
+
+    # Guarda los registros: en formato Prometheus si el fichero termina en .prom, en JSON lines en otro caso
+    def export(self, file_path):
+        with open(file_path, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus() if file_path.endswith('.prom') else self.to_json_lines())
@@ -0,0 +1,68 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+query_plan_cache.py
+Authors: Carlos Giralt and Berta Olano
+
+
+In-memory LRU cache of query plans used by search.py. parseQuery stores the Whoosh query tree built for an
+information need keyed on its normalized text (whitespace collapsed), so repeated needs skip cleanQuery, the
+vocabulary matching, spaCy and the parsers. The cache is bounded in number of entries and keeps hit/miss counters.
+It is emptied when the year changes, since needs such as "los últimos años" depend on the current year.
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+# Número máximo de planes guardados por defecto
+PLAN_CACHE_SIZE = 1024
+
+# Texto normalizado de una necesidad: los espacios, tabuladores y saltos de línea consecutivos cuentan como uno
+def normalize_text(query_text):
+    return " ".join(query_text.split())
+
+class QueryPlanCache:
+    def __init__(self, max_size=PLAN_CACHE_SIZE):
+        self.max_size = max_size
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.year = datetime.now().year
+
+    def __contains__(self, query_text):
+        return normalize_text(query_text) in self.plans
+
+    def __len__(self):
+        return len(self.plans)
+
+    # Devuelve la query guardada para el texto, o None si no está en la caché
+    def get(self, query_text):
+        year = datetime.now().year
+        if year != self.year:
+            self.year = year
+            self.clear()
+        key = normalize_text(query_text)
+        query = self.plans.get(key)
+        if query is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.plans.move_to_end(key)
+        return query
+
+    # Guarda la query del texto, descartando la usada hace más tiempo si se supera el tamaño máximo
+    def put(self, query_text, query):
+        key = normalize_text(query_text)
+        self.plans[key] = query
+        self.plans.move_to_end(key)
+        while len(self.plans) > self.max_size:
+            self.plans.popitem(last=False)
+
+    def clear(self):
+        self.plans.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.plans), 'max_size': self.max_size,
+                'hit_rate': round(self.hit_rate(), 3)}
@@ -0,0 +1,107 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+result_cache.py
+Authors: Carlos Giralt and Berta Olano
+
+
+Persistent cache of search results used by search.py. Results are kept in memory and on disk (one JSON file per
+query), keyed on the processed query, the scoring model and the version of the index (generation and time of the
+last commit), so the cache is discarded automatically whenever the index is rebuilt or updated.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from index_version import index_version
+
+class ResultCache:
+    def __init__(self, cache_folder, index, model_type):
+        self.cache_folder = cache_folder
+        self.model_type = model_type
+        self.memory = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_folder, exist_ok=True)
+        self.set_index_version(index)
+
+    # Si el índice ha cambiado desde que se guardaron los resultados, se vacía la caché. Varios procesos (-workers o
+    # los searchers del servidor) pueden hacerlo a la vez sobre la misma carpeta, por lo que el fichero de versión
+    # puede desaparecer entre que se comprueba y se lee
+    def set_index_version(self, index):
+        self.version = index_version(index)
+        self.memory = {}
+        version_file = os.path.join(self.cache_folder, 'version.json')
+        stored_version = None
+        try:
+            with open(version_file, 'r', encoding='utf-8') as file:
+                stored_version = json.load(file).get('version')
+        except FileNotFoundError:
+            pass
+        if stored_version != self.version:
+            self.clear()
+            self.write_json(version_file, {'version': self.version})
+
+    # Borra los resultados guardados y los ficheros temporales que hayan quedado de escrituras interrumpidas. Los
+    # ficheros que otro proceso ya ha borrado se ignoran
+    def clear(self):
+        self.memory = {}
+        for file in os.listdir(self.cache_folder):
+            if file.endswith('.json') or file.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.cache_folder, file))
+                except FileNotFoundError:
+                    pass
+
+    # Clave de una query: la versión del índice, el modelo de recuperación y la query normalizada (incluidos los
+    # boosts). Con la versión en la clave, un searcher que aún busca sobre una generación anterior (otro proceso o
+    # searcher del pool que comparte la carpeta) no puede servir ni hacer pasar por actuales sus resultados
+    def key(self, query):
+        return f"{self.version}\t{self.model_type}\t{query.normalize()!r}"
+
+    def file_path(self, key):
+        return os.path.join(self.cache_folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    # Devuelve la lista de resultados guardada para la query, o None si no está en la caché
+    def get(self, query):
+        key = self.key(query)
+        results = self.memory.get(key)
+        if results is None:
+            # el fichero puede no existir o haberlo borrado otro proceso al vaciar la caché
+            entry = None
+            try:
+                with open(self.file_path(key), 'r', encoding='utf-8') as file:
+                    entry = json.load(file)
+            except FileNotFoundError:
+                pass
+            if entry is not None and entry['key'] == key:
+                results = [tuple(result) for result in entry['results']]
+                self.memory[key] = results
+        if results is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return results
+
+    def put(self, query, results):
+        key = self.key(query)
+        self.memory[key] = results
+        self.write_json(self.file_path(key), {'key': key, 'results': results})
+
+    # Escritura atómica (fichero temporal + rename), ya que varios procesos pueden compartir la caché
+    # Si la escritura falla, se borra el fichero temporal. Si otro proceso ha vaciado la caché mientras tanto (y con
+    # ello borrado el fichero temporal), la entrada simplemente no se guarda
+    def write_json(self, file_path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+            os.replace(tmp_path, file_path)
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
@@ -5,21 +5,38 @@ Authors: Carlos Giralt and Berta Olano
 
 Program to search a free text query on a previously created inverted index.
 This program is based on the whoosh library. See https://pypi.org/project/Whoosh/ .
-Usage: python3 search.py -index <indexPath> -infoNeeds <queryFile> -output <resultsFile>
+Usage: python3 search.py -index <indexPath> -infoNeeds <queryFile> -output <resultsFile> [-workers <numProcesses>]
+       [-cache <cacheFolder>] [-metrics <metricsFile.jsonl|.prom>] [-planCache <size>]
+       [-execution default|topk|exhaustive] [-filterFirst] [-sortByYear]
 """
 
 import re
 import sys
 import spacy
+from collections import OrderedDict
 from datetime import datetime
+from multiprocessing import Pool
 
 
 from whoosh.qparser import QueryParser, OrGroup, MultifieldParser
 from whoosh import scoring
 import whoosh.index as index
 from whoosh.query import And,Or
-from whoosh.query import NumericRange, Term
+from whoosh.query import NumericRange, Term, Every, Query
+from whoosh.matching import ListMatcher
+from whoosh.scoring import WeightScorer
+from array import array
 import xml.etree.ElementTree as ET
+from result_cache import ResultCache
+from filters import FilterQuery
+from instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from query_plan_cache import QueryPlanCache, PLAN_CACHE_SIZE
+from column_store import ColumnStore
+from facets import FacetIndex, MatchSetCollector
+import numpy as np
+
+# Modelo de spaCy utilizado para el reconocimiento de entidades (nombres de personas)
+SPACY_MODEL = "es_core_news_sm"
 
 # Array de strings equivalntes a TAZ-TFG para la consulta de tipo de documento
 TFG_equivalents = [
@@ -82,6 +99,63 @@ Stop_words = [
     "durante", "este", "otro", "otra", "estoy", "quiero"
 ]
 
+# Expresión regular que elimina en una sola pasada todas las palabras y expresiones de las listas anteriores.
+# Las alternativas se prueban en el mismo orden en que antes se aplicaba un re.sub por palabra (primero los tipos
+# de documento, idiomas y palabras poco significativas, después las palabras vacías), de modo que en cada posición
+# se elimina la misma expresión que eliminaba el recorrido secuencial. La única diferencia es que una expresión
+# que empieza antes en el texto ya no se rompe por haber eliminado previamente otra contenida en ella
+# (p. ej. "tfg - trabajo de fin de grado" se elimina completa en lugar de dejar "tfg -")
+def compileDeletePattern(word_lists):
+    words = list(dict.fromkeys(word for word_list in word_lists for word in word_list))
+    return re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in words) + r')\b')
+
+DELETE_PATTERN = compileDeletePattern([TFG_equivalents, TFM_equivalents, Tesis_equivalents, PFC_equivalents,
+                                       Spanish_equivalents, English_equivalents, Other_Words, Stop_words])
+
+# Construye una expresión regular equivalente a la alternativa de todas las palabras, factorizando los prefijos
+# comunes en forma de trie. En cada posición encaja siempre la palabra más larga que empieza en ella
+def trieRegex(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char != '']
+        if not alternatives:
+            return ''
+        body = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        return '(?:' + body + ')?' if '' in node else body
+    return build(trie)
+
+# Detector de expresiones de tipo de documento e idioma. Encuentra en una sola pasada todas las expresiones del
+# vocabulario que aparecen como subcadena del texto: en cada posición se obtiene la expresión más larga que empieza
+# en ella y se añaden las expresiones contenidas en ésta (como las salidas de un autómata de Aho-Corasick).
+# Se recuerda el último texto analizado, ya que docTypeQuery y languageQuery se aplican sobre la misma consulta
+class VocabularyMatcher:
+    def __init__(self, word_lists):
+        words = list(dict.fromkeys(word for word_list in word_lists for word in word_list))
+        self.pattern = re.compile(r'(?=(' + trieRegex(words) + r'))')
+        self.contained = {word: {other for other in words if other in word} for word in words}
+        self.last = (None, set())
+
+    # Devuelve el conjunto de expresiones del vocabulario presentes en el texto
+    def find(self, text):
+        last_text, last_found = self.last
+        if text == last_text:
+            return last_found
+        found = set()
+        for match in self.pattern.finditer(text):
+            word = match.group(1)
+            if word not in found:
+                found |= self.contained[word]
+        self.last = (text, found)
+        return found
+
+VOCABULARY_MATCHER = VocabularyMatcher([TFG_equivalents, TFM_equivalents, Tesis_equivalents, PFC_equivalents,
+                                        Spanish_equivalents, English_equivalents])
+
 # Sustituye todos los signos de puntuación por puntos, o los elimina si no son necesarios
 def cleanQuery(query_text):
     # substituimos signos de puntuación por puntos
@@ -97,15 +171,8 @@ def deleteUnnecessaryWords(sentence):
     lowerCase = sentence.lower()
     # eliminamos palabras relacionadas con el tipo de proyecto, lenguaje y palabras comunes sobre autoría, dirección, etc
     # eliminamos también palabras que no aporten demasiada información en los campos en los que buscamos
-    deleteWords = [TFG_equivalents, TFM_equivalents, Tesis_equivalents, PFC_equivalents, 
-                    Spanish_equivalents, English_equivalents, Other_Words]
-    for dict in deleteWords:
-        for word in dict:
-             lowerCase = re.sub(r'\b' + re.escape(word) + r'\b', '', lowerCase)
-    
-    # eliminamos stop words en español
-    for stop in Stop_words:
-        lowerCase = re.sub(r'\b' + re.escape(stop) + r'\b', '', lowerCase)
+    # y las stop words en español
+    lowerCase = DELETE_PATTERN.sub('', lowerCase)
 
     lowerCase = re.sub(r'\s+', ' ', lowerCase).strip()
     return lowerCase    
@@ -132,11 +199,12 @@ def mainQuery(query_text, searcher):
 # Búsquedas de tipo de documento: tesis, tfg, tfm, ...
 def docTypeQuery(query_text):
     lowerCaseQuery = query_text.lower()
+    found = VOCABULARY_MATCHER.find(lowerCaseQuery)
     typeSearched = []
     deleteWords = [TFG_equivalents, TFM_equivalents, Tesis_equivalents, PFC_equivalents]
     for dict in deleteWords:
         for word in dict:
-            if word in lowerCaseQuery:
+            if word in found:
                 t = Term("docType", dict[0])
                 t.boost *= 1.5
                 typeSearched.append(t)
@@ -146,25 +214,30 @@ def docTypeQuery(query_text):
 # para filtrar los documentos en base a dichas preferencias
 def languageQuery(query_text):
     lowerCaseQuery = query_text.lower()
+    found = VOCABULARY_MATCHER.find(lowerCaseQuery)
     langSearched = []
     for term in Spanish_equivalents:
-        if re.search(r'.*' + term + r'.*', lowerCaseQuery):
+        if term in found:
             t = Term("language", "es")
             t.boost *= 2.0
             langSearched.append(t)
     
     for term in English_equivalents:
-        if re.search(r'.*' + term + r'.*', lowerCaseQuery):
+        if term in found:
             t = Term("language", "eng")
             t.boost *= 2.0
             langSearched.append(t)
     return Or(langSearched)
 
-# Búsqueda de autores y directores de los trabajos
-def namesQuery(query_text, searcher):
+# Texto sobre el que se ejecuta el reconocimiento de entidades de una necesidad de información
+def nerText(query_text):
+    return cleanQuery(query_text).lower()
+
+# Búsqueda de autores y directores de los trabajos. Si ya se ha analizado el texto con spaCy
+# (procesado por lotes de las necesidades de información) se reutiliza el documento obtenido
+def namesQuery(query_text, searcher, nlp_doc=None):
     query_text = query_text.lower()
-    nlp = spacy.load("es_core_news_sm")
-    doc = nlp(query_text)
+    doc = nlp_doc if nlp_doc is not None else searcher.get_nlp()(query_text)
     names = []
     authorQueries = []
     contributorQueries = []
@@ -262,25 +335,83 @@ def publishingYearQuery(query_text):
 
 # Devuelve la query obtenida como conjunción de disyunciones obtenida al procesar la necesidad
 # información
-def parseQuery(query_text, searcher):
+def parseQuery(query_text, searcher, nlp_doc=None):
+    probe = searcher.instrumentation
+    # si la misma necesidad ya se ha procesado, se reutiliza la query construida
+    plans = searcher.plans
+    if plans is not None:
+        finalQuery = plans.get(query_text)
+        if finalQuery is not None:
+            probe.count('plan_hits')
+            return finalQuery
     # Eliminamos interrogantes y otros signos de puntuación distintos del punto
-    query = cleanQuery(query_text)
-    keyWordQuery, titleAndDescQuery = mainQuery(query, searcher)
-    docQuery = docTypeQuery(query)
-    lanQuery = languageQuery(query)
-    authorQuery, contributorQuery = namesQuery(query, searcher)
-    depQuery = departmentQuery(query, searcher)
-    tempQuery = publishingYearQuery(query)
+    with probe.timer('cleanQuery'):
+        query = cleanQuery(query_text)
+    with probe.timer('mainQuery'):
+        keyWordQuery, titleAndDescQuery = mainQuery(query, searcher)
+    with probe.timer('docTypeQuery'):
+        docQuery = docTypeQuery(query)
+    with probe.timer('languageQuery'):
+        lanQuery = languageQuery(query)
+    with probe.timer('namesQuery'):
+        authorQuery, contributorQuery = namesQuery(query, searcher, nlp_doc)
+    with probe.timer('departmentQuery'):
+        depQuery = departmentQuery(query, searcher)
+    with probe.timer('publishingYearQuery'):
+        tempQuery = publishingYearQuery(query)
 
     queries = [query for query in [keyWordQuery, titleAndDescQuery, docQuery, lanQuery, authorQuery, contributorQuery, depQuery, tempQuery] if query]
     finalQuery = And(queries)
+    probe.count('clauses', len(queries))
+    if plans is not None:
+        plans.put(query_text, finalQuery)
     #print(finalQuery)
     return finalQuery
 
 
+# Modos de ejecución de las queries: default (el de Whoosh), topk (la poda por calidad de Whoosh, extendida a las
+# queries con rango de años) y exhaustive (se puntúan todos los documentos, sin poda ni sustitución del matcher).
+# default y topk son aproximados: la sustitución del matcher de Whoosh según la puntuación mínima de los 100 primeros
+# puede descartar documentos que sí entrarían, tanto en un único segmento como, con más frecuencia, en índices con
+# varios segmentos (-commitEvery, -merge none, -update). Tampoco son siempre más rápidos que exhaustive. El único
+# ranking exacto es exhaustive; benchmark_search.py -compareTopK mide las diferencias y latencias de cada modo
+EXECUTION_MODES = ('default', 'topk', 'exhaustive')
+
+# NumericRange puntúa todos los documentos con una constante (el boost) mediante un ListMatcher sin scorer, por lo que
+# la intersección que lo contiene no puede usar las cotas de calidad de bloque del TopCollector de Whoosh y recorre
+# todos los documentos. Esta versión publica esa constante como calidad, con la misma puntuación, de modo que la poda
+# de Whoosh (aproximada, ver EXECUTION_MODES) también se aplica a esas queries
+class QualityNumericRange(NumericRange):
+    def matcher(self, searcher, context=None):
+        m = NumericRange.matcher(self, searcher, context)
+        if isinstance(m, ListMatcher) and not m.supports_block_quality() and self.constantscore:
+            return ListMatcher(array("I", m.all_ids()), all_weights=self.boost, scorer=WeightScorer(self.boost),
+                               term=m.term())
+        return m
+
+# Devuelve una copia de la query en la que los rangos numéricos admiten la poda por calidad (modo topk)
+def topKQuery(query):
+    def rewrite(q):
+        if type(q) is NumericRange:
+            return QualityNumericRange(q.fieldname, q.start, q.end, q.startexcl, q.endexcl, boost=q.boost,
+                                       constantscore=q.constantscore)
+        return q
+    return query.accept(rewrite)
+
+# Campos de las cláusulas estructuradas (docTypeQuery, languageQuery y publishingYearQuery), que en el modo
+# filter_first se aplican como filtro en vez de puntuarse
+STRUCTURED_FIELDS = {'docType', 'language', 'publishingyear'}
+# Número máximo de filtros (conjuntos de documentos) guardados por cada searcher
+FILTER_CACHE_SIZE = 256
+
+def isStructured(query):
+    return all(getattr(leaf, 'fieldname', None) in STRUCTURED_FIELDS for leaf in query.leaves())
+
 class MySearcher:
-    def __init__(self, index_folder, model_type = 'tfidf'):
+    def __init__(self, index_folder, model_type = 'tfidf', cache_folder = None, instrumentation = None,
+                 plan_cache_size = PLAN_CACHE_SIZE, execution = 'default', filter_first = False, sort_by_year = False):
         ix = index.open_dir(index_folder)
+        self.index = ix
         if model_type == 'tfidf':
             # Apply a vector retrieval model as default
             self.searcher = ix.searcher(weighting=scoring.TF_IDF())
@@ -292,21 +423,263 @@ class MySearcher:
         self.AuthorNameParser = QueryParser("creator", ix.schema, group = OrGroup)
         self.ContrNameParser = QueryParser("contributor", ix.schema, group = OrGroup)
         self.PubliParser = QueryParser("publisher", ix.schema, group = OrGroup)
+        self.nlp = None     # modelo de spaCy, se carga la primera vez que se necesita
+        # caché persistente de resultados (opcional)
+        # (las puntuaciones cambian al filtrar las cláusulas estructuradas, el orden al ordenar por año y los 100 primeros
+        # según el modo de ejecución, por lo que se guardan aparte)
+        variant = (model_type + ('+filters' if filter_first else '') + ('+year' if sort_by_year else '') +
+                   ('' if execution == 'default' else '+' + execution))
+        self.cache = ResultCache(cache_folder, ix, variant) if cache_folder else None
+        # caché en memoria de las queries construidas por parseQuery (0: desactivada)
+        self.plans = QueryPlanCache(plan_cache_size) if plan_cache_size else None
+        if execution not in EXECUTION_MODES:
+            raise ValueError(f"Modo de ejecución no válido: {execution} (opciones: {', '.join(EXECUTION_MODES)})")
+        self.execution = execution     # modo de ejecución de las queries (EXECUTION_MODES)
+        self.filter_first = filter_first   # aplica las cláusulas estructuradas como filtro
+        self.filters = OrderedDict()   # caché LRU de filtros: cláusula estructurada -> array de sus documentos
+        self.sort_by_year = sort_by_year   # ordena los resultados por año de publicación
+        # columnas de los campos numéricos escritas por index.py (None si no existen o son de otra versión del índice)
+        self.columns = ColumnStore.load(ix)
+        self.facet_index = None    # arrays de valores de las facetas, se construyen la primera vez que se necesitan
+        # medidas de tiempo y contadores de cada consulta (desactivadas por defecto)
+        self.instrumentation = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+
+    # Devuelve el modelo de spaCy, cargándolo una única vez con solo el componente de entidades (NER) activo
+    def get_nlp(self):
+        if self.nlp is None:
+            self.nlp = spacy.load(SPACY_MODEL)
+            self.nlp.select_pipes(enable=["ner"])
+        return self.nlp
+
+    # Si se ha hecho commit de una nueva generación del índice, pasa a buscar sobre ella. Devuelve True si ha cambiado
+    def refresh(self):
+        if self.searcher.up_to_date():
+            return False
+        self.searcher = self.searcher.refresh()
+        self.filters.clear()
+        self.columns = ColumnStore.load(self.index)
+        self.facet_index = None
+        if self.cache is not None:
+            self.cache.set_index_version(self.index)
+        return True
+
+    # Analiza por lotes con spaCy los textos de varias necesidades de información
+    def ner_docs(self, query_texts):
+        return list(self.get_nlp().pipe([nerText(text) for text in query_texts]))
 
     def search(self, query, query_id, output_file):
+        results = self.run_query(query)
+        with self.instrumentation.timer('write'):
+            self.write_results(query, query_id, results, output_file)
+
+    # Ejecuta la query y devuelve los 100 primeros resultados como tuplas (path, score, identifier).
+    # wrap_collector permite envolver el collector de Whoosh (p. ej. para poder cancelar una búsqueda en curso)
+    def run_query(self, query, wrap_collector = None):
+        probe = self.instrumentation
+        if self.cache is not None:
+            cached = self.cache.get(query)
+            if cached is not None:
+                probe.count('cache_hits')
+                probe.count('hits', len(cached))
+                return cached
+        #limitamos los resultados de cada búsqueda a 100
+        with probe.timer('whoosh'):
+            search_query = self.filterFirstQuery(query) if self.filter_first else query
+            if self.execution == 'topk':
+                search_query = topKQuery(search_query)
+            if self.sort_by_year and self.columns is not None and 'publishingyear' in self.columns:
+                results = self.searchByYear(search_query, wrap_collector)
+            else:
+                collector = self.searcher.collector(limit = 100, optimize = self.execution != 'exhaustive')
+                if self.execution == 'exhaustive':
+                    # sin optimize, Whoosh sigue sustituyendo el matcher por uno que descarta los documentos que según
+                    # las cotas de calidad ya no pueden entrar entre los primeros; con replace = 0 no lo hace
+                    collector.replace = 0
+                if wrap_collector is not None:
+                    collector = wrap_collector(collector)
+                self.searcher.search_with_collector(search_query, collector)
+                results = [(result.get("path"), result.score, result.get("identifier")) for result in collector.results()]
+        if probe.enabled:
+            probe.count('doc_frequency', self.docFrequency(query))
+            probe.count('hits', len(results))
+        if self.cache is not None:
+            self.cache.put(query, results)
+        return results
+
+    # Arrays de valores de las facetas para la generación actual del índice
+    def facetIndex(self):
+        if self.facet_index is None:
+            self.facet_index = FacetIndex(self.searcher.reader(), self.index.schema, self.columns)
+        return self.facet_index
+
+    # Ejecuta la query y devuelve los 100 primeros resultados y los recuentos por tipo de documento, idioma, año y
+    # departamento de todos los documentos que la cumplen: {campo: [(valor, documentos), ...]}. Los documentos se
+    # recogen en la misma pasada que los puntúa, por lo que no se poda ni se sustituye el matcher (los 100 primeros
+    # son los de la puntuación completa, que pueden diferir de los de run_query) ni se usa la caché de resultados
+    def facetSearch(self, query):
+        probe = self.instrumentation
+        facet_index = self.facetIndex()
+        with probe.timer('whoosh'):
+            search_query = self.filterFirstQuery(query) if self.filter_first else query
+            if self.sort_by_year and self.columns is not None and 'publishingyear' in self.columns:
+                top_n = self.searcher.search(search_query, limit = None).top_n
+                results = self.topByYear(top_n)
+                docnums = [docnum for _, docnum in top_n]
+            else:
+                collector = MatchSetCollector(self.searcher.collector(limit = 100, optimize = False))
+                self.searcher.search_with_collector(search_query, collector)
+                results = [(result.get("path"), result.score, result.get("identifier")) for result in collector.results()]
+                docnums = collector.docnums
+        with probe.timer('facets'):
+            facets = facet_index.counts(docnums)
+        probe.count('hits', len(results))
+        return results, facets
+
+    # Sustituye las cláusulas estructuradas de la query por un único filtro, la intersección de sus documentos,
+    # de modo que solo se puntúan las cláusulas de texto
+    def filterFirstQuery(self, query):
+        clauses = query.subqueries if isinstance(query, And) else [query]
+        allowed = None
+        for clause in clauses:
+            if isStructured(clause):
+                docs = self.filterDocs(clause)
+                allowed = docs if allowed is None else np.intersect1d(allowed, docs, assume_unique=True)
+        if allowed is None:
+            return query
+        textQueries = [clause for clause in clauses if not isStructured(clause)]
+        return And((textQueries or [Every()]) + [FilterQuery(allowed)])
+
+    # Documentos que cumplen una cláusula estructurada, como array ordenado. Se reutilizan entre queries, ya que solo
+    # hay unos pocos tipos de documento, idiomas y rangos de años distintos; si se llena la caché se descarta el filtro
+    # usado hace más tiempo, como en query_plan_cache.py
+    def filterDocs(self, clause):
+        key = repr(clause.normalize())
+        docs = self.filters.get(key)
+        if docs is None:
+            docs = self.yearDocs(clause)
+            if docs is None:
+                docs = np.fromiter(self.searcher.docs_for_query(clause), dtype=np.int64)
+                docs = np.unique(docs)
+            self.filters[key] = docs
+            while len(self.filters) > FILTER_CACHE_SIZE:
+                self.filters.popitem(last=False)
+        else:
+            self.filters.move_to_end(key)
+        return docs
+
+    # Documentos de una cláusula de años (disyunción de rangos y años sueltos) obtenidos de la columna publishingyear
+    # sin recorrer los postings. Devuelve None si la cláusula no es de ese tipo o no hay columnas
+    def yearDocs(self, clause):
+        if self.columns is None or 'publishingyear' not in self.columns:
+            return None
+        if not (isinstance(clause, Or) or clause.is_leaf()):
+            return None
+        docs = np.zeros(0, dtype=np.int64)
+        for leaf in clause.leaves():
+            if getattr(leaf, 'fieldname', None) != 'publishingyear':
+                return None
+            if isinstance(leaf, NumericRange):
+                start = None if leaf.start is None else int(leaf.start) + (1 if leaf.startexcl else 0)
+                end = None if leaf.end is None else int(leaf.end) - (1 if leaf.endexcl else 0)
+            elif isinstance(leaf, Term):
+                start = end = int(leaf.text)
+            else:
+                return None
+            docs = np.union1d(docs, self.columns.range_docs('publishingyear', start, end))
+        return docs
+
+    # Todos los documentos de la query ordenados por año de publicación (los más recientes primero y los que no tienen
+    # año al final) y, a igual año, por puntuación. Devuelve los 100 primeros como tuplas (path, score, identifier)
+    # wrap_collector envuelve el collector de Whoosh, como en run_query
+    def searchByYear(self, query, wrap_collector = None):
+        collector = self.searcher.collector(limit = None)
+        if wrap_collector is not None:
+            collector = wrap_collector(collector)
+        self.searcher.search_with_collector(query, collector)
+        return self.topByYear(collector.results().top_n)
+
+    # Los 100 primeros de una lista de pares (score, docnum) según el orden de searchByYear
+    def topByYear(self, top_n):
+        scores = np.array([score for score, _ in top_n], dtype=np.float64)
+        docnums = np.array([docnum for _, docnum in top_n], dtype=np.int64)
+        years = self.columns['publishingyear'][docnums].astype(np.int64)
+        top = np.lexsort((docnums, -scores, -years))[:100]
+        results = []
+        for position in top:
+            fields = self.searcher.stored_fields(int(docnums[position]))
+            results.append((fields.get("path"), float(scores[position]), fields.get("identifier")))
+        return results
+
+    # Suma de las frecuencias de documento de todos los términos de la query, es decir, la longitud total de sus listas
+    # de postings. Es una medida del trabajo de la búsqueda, no los postings que leen los matchers (que pueden saltarse
+    # bloques enteros al podar)
+    def docFrequency(self, query):
+        return sum(self.searcher.doc_frequency(fieldname, text) for fieldname, text in query.iter_all_terms())
+
+    # Muestra los resultados de una query y los escribe en el fichero de resultados
+    def write_results(self, query, query_id, results, output_file):
         print("Búsqueda de la Query procesada: ", query)
-        results = self.searcher.search(query, limit = 100)
         print('Returned documents:')
         i = 1
-        for result in results:
-            identifier = result.get("identifier")
-            print(f'{i} - File path: {result.get("path")}, Similarity score: {result.score}, identifier:{result.get("identifier")}')
+        for path, score, identifier in results:
+            print(f'{i} - File path: {path}, Similarity score: {score}, identifier:{identifier}')
             # Escribir el número de consulta y el identificador en el archivo de resultados
             output_file.write(f"{query_id}\t{identifier}\n")
             i += 1
 
+# Buscador propio de cada proceso del pool de búsqueda (-workers), con su propio searcher de Whoosh y modelo de spaCy
+worker_searcher = None
+
+# settings: argumentos de MySearcher por nombre, más instrumented (activa la instrumentación en el proceso)
+def init_worker(settings):
+    global worker_searcher
+    settings = dict(settings)
+    instrumented = settings.pop('instrumented', False)
+    worker_searcher = MySearcher(instrumentation=Instrumentation() if instrumented else None, **settings)
+
+# Aciertos y fallos de la caché de resultados y de la caché de queries de un buscador (0 si no tiene caché)
+def cache_counts(searcher):
+    counts = {}
+    for name, cache in (('cache', searcher.cache), ('plans', searcher.plans)):
+        counts[name] = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    return counts
+
+# Procesa y ejecuta un bloque de necesidades de información en un proceso del pool. El reconocimiento de entidades
+# de las necesidades que no están en la caché de queries se hace en un único lote, como en la búsqueda secuencial.
+# Devuelve, para cada necesidad, la query procesada (como texto), sus resultados, que el proceso principal escribe en
+# el orden original de las necesidades, el registro de la instrumentación (None si está desactivada) y los aciertos y
+# fallos de las cachés del proceso durante la necesidad, que el proceso principal suma a los de sus cachés
+def search_needs(needs):
+    probe = worker_searcher.instrumentation
+    plans = worker_searcher.plans
+    pending = [query_text for _, query_text in needs if plans is None or query_text not in plans]
+    nlp_docs = dict(zip(pending, worker_searcher.ner_docs(pending))) if pending else {}
+    answers = []
+    for query_id, query_text in needs:
+        before = cache_counts(worker_searcher)
+        with probe.query(query_id):
+            processedQuery = parseQuery(query_text, worker_searcher, nlp_docs.get(query_text))
+            results = worker_searcher.run_query(processedQuery)
+        after = cache_counts(worker_searcher)
+        counts = {name: (after[name][0] - before[name][0], after[name][1] - before[name][1]) for name in after}
+        answers.append((str(processedQuery), results, probe.records.pop() if probe.enabled else None, counts))
+    return answers
+
+# Divide las necesidades en bloques contiguos, unos chunks_per_worker por proceso, para repartir la carga entre los
+# procesos sin renunciar al análisis por lotes de spaCy
+def need_chunks(needs, workers, chunks_per_worker=4):
+    size = max(1, -(-len(needs) // (workers * chunks_per_worker)))
+    return [needs[start:start + size] for start in range(0, len(needs), size)]
+
 if __name__ == '__main__':
     index_folder = '../whooshindexZaguan' #indice por defecto
+    workers = 1     #número de procesos de búsqueda (1 = búsqueda secuencial)
+    cache_folder = None     #carpeta de la caché de resultados (sin caché por defecto)
+    metrics_file = None     #fichero de métricas de la instrumentación (.prom: Prometheus, otro: JSON lines)
+    plan_cache_size = PLAN_CACHE_SIZE   #número de queries procesadas guardadas en memoria (0: sin caché)
+    execution = 'default'   #modo de ejecución de las queries (default, topk o exhaustive)
+    filter_first = False    #aplica las cláusulas de tipo de documento, idioma y año como filtro
+    sort_by_year = False    #ordena los resultados por año de publicación (más recientes primero)
     i = 1
     infor=False
     while (i < len(sys.argv)):
@@ -319,23 +692,76 @@ if __name__ == '__main__':
         if sys.argv[i] == '-output':
             resultsFile = sys.argv[i+1] #guarda el fichero de resultados
             i += 1
+        if sys.argv[i] == '-workers':
+            workers = int(sys.argv[i+1])    #guarda el número de procesos de búsqueda
+            i += 1
+        if sys.argv[i] == '-cache':
+            cache_folder = sys.argv[i+1]    #guarda la carpeta de la caché de resultados
+            i += 1
+        if sys.argv[i] == '-metrics':
+            metrics_file = sys.argv[i+1]    #activa la instrumentación y guarda el fichero de métricas
+            i += 1
+        if sys.argv[i] == '-planCache':
+            plan_cache_size = int(sys.argv[i+1])    #guarda el tamaño de la caché de queries procesadas
+            i += 1
+        if sys.argv[i] == '-execution':
+            execution = sys.argv[i+1]   #guarda el modo de ejecución de las queries
+            if execution not in EXECUTION_MODES:
+                print(f"Modo de ejecución no válido: {execution} (opciones: {', '.join(EXECUTION_MODES)})")
+                sys.exit(1)
+            i += 1
+        if sys.argv[i] == '-filterFirst':
+            filter_first = True
+        if sys.argv[i] == '-sortByYear':
+            sort_by_year = True
         i = i + 1
 
-    searcher = MySearcher(index_folder)
+    # argumentos del buscador, los mismos para el proceso principal y para los procesos del pool
+    searcher_settings = dict(index_folder=index_folder, model_type='tfidf', cache_folder=cache_folder,
+                             plan_cache_size=plan_cache_size, execution=execution, filter_first=filter_first,
+                             sort_by_year=sort_by_year)
+    searcher = MySearcher(instrumentation=Instrumentation() if metrics_file else None, **searcher_settings)
+    probe = searcher.instrumentation
 
      # Procesar las consultas y guardar los resultados
     try:
         with open(resultsFile, 'w', encoding='utf-8') as output_file:
             tree = ET.parse(queryFile)
             root = tree.getroot()
-            for child in root.findall('informationNeed'):
-                query_count = child.find('identifier').text
-                query=child.find('text').text
-                print(f"\nEjecutando búsqueda para la query {query_count}: '{query}'")
-                    # Obtener los resultados de la búsqueda
-                processedQuery = parseQuery(query, searcher)
-                results = searcher.search(processedQuery, query_count, output_file)
+            needs = [(child.find('identifier').text, child.find('text').text) for child in root.findall('informationNeed')]
+            if workers > 1:
+                # las necesidades se procesan en paralelo, pero los resultados se escriben en el orden original
+                with Pool(processes=workers, initializer=init_worker,
+                          initargs=({**searcher_settings, 'instrumented': probe.enabled},)) as pool:
+                    chunks = pool.imap(search_needs, need_chunks(needs, workers))
+                    answers = (answer for chunk in chunks for answer in chunk)
+                    for (query_count, query), (processedQuery, results, record, counts) in zip(needs, answers):
+                        print(f"\nEjecutando búsqueda para la query {query_count}: '{query}'")
+                        searcher.write_results(processedQuery, query_count, results, output_file)
+                        if probe.enabled:
+                            probe.add_record(record)
+                        # las estadísticas de las cachés son las de los procesos del pool
+                        for cache, (hits, misses) in ((searcher.cache, counts['cache']), (searcher.plans, counts['plans'])):
+                            if cache is not None:
+                                cache.hits += hits
+                                cache.misses += misses
+            else:
+                # reconocimiento de entidades de todas las necesidades en un único lote
+                nlp_docs = searcher.ner_docs([query for _, query in needs])
+                for (query_count, query), nlp_doc in zip(needs, nlp_docs):
+                    print(f"\nEjecutando búsqueda para la query {query_count}: '{query}'")
+                        # Obtener los resultados de la búsqueda
+                    with probe.query(query_count):
+                        processedQuery = parseQuery(query, searcher, nlp_doc)
+                        results = searcher.search(processedQuery, query_count, output_file)
     except FileNotFoundError:
         print(f"El archivo {queryFile} no se encontró.")
     except Exception as e:
-        print(f"Se produjo un error: {e}")
\ No newline at end of file
+        print(f"Se produjo un error: {e}")
+    if searcher.cache is not None:
+        print(f"Caché de resultados: {searcher.cache.hits} aciertos, {searcher.cache.misses} fallos")
+    if searcher.plans is not None:
+        print(f"Caché de queries: {searcher.plans.hits} aciertos, {searcher.plans.misses} fallos")
+    if metrics_file:
+        probe.export(metrics_file)
+        print(f"Métricas de {len(probe.records)} consultas guardadas en {metrics_file}")
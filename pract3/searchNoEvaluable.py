@@ -5,12 +5,12 @@ Authors: Carlos Giralt and Berta Olano
 
 Program to search a free text query on a previously created inverted index.
 This program is based on the whoosh library. See https://pypi.org/project/Whoosh/ .
-Usage: python3 search.py -index <indexPath> -infoNeeds <queryFile> -output <resultsFile>
+Usage: python3 search.py -index <indexPath> -infoNeeds <queryFile> -output <resultsFile> [-spatialWeight <weight>]
 """
 
 import re
 import sys
-import spacy
+import numpy as np
 
 
 from whoosh.qparser import QueryParser
@@ -20,8 +20,22 @@ import whoosh.index as index
 from whoosh.query import And,Or
 from whoosh.query import NumericRange
 import xml.etree.ElementTree as ET
-
+from filters import FilterQuery
+from spatial_index import SpatialIndex
+from column_store import ColumnStore
+from index_version import index_version
+
+# Puntuación de los documentos que cumplen la parte espacial de la consulta: la misma que daba el And de los cuatro
+# rangos numéricos (1.0 cada uno)
+SPATIAL_SCORE = 4.0
+# Peso por defecto del solapamiento espacial frente a la puntuación de texto al combinar ambas. Con 0 no se combinan y
+# la parte espacial se puntúa como siempre (SPATIAL_SCORE para los documentos cuya caja corta a la de la consulta);
+# la combinación se activa con -spatialWeight
+SPATIAL_WEIGHT = 0.0
+
+# (no se usa en la búsqueda; spaCy se importa aquí para que el buscador no dependa de él)
 def parser(query_text):
+    import spacy
     nlp = spacy.load ("es_core_news_sm")
     doc = nlp ( query_text )
     # Find named entities , phrases and concepts
@@ -84,7 +98,7 @@ def findCoord(query_text):
         return None, None, None, None, query_text
 
 class MySearcher:
-    def __init__(self, index_folder, model_type = 'tfidf'):
+    def __init__(self, index_folder, model_type = 'tfidf', spatial_weight = SPATIAL_WEIGHT):
         ix = index.open_dir(index_folder)
         if model_type == 'tfidf':
             # Apply a vector retrieval model as default
@@ -93,17 +107,74 @@ class MySearcher:
             # Apply the probabilistic BM25F model, the default model in searcher method
             self.searcher = ix.searcher()
         self.parser = QueryParser("content", ix.schema, group = OrGroup)
+        # índice espacial guardado junto al índice (None si no existe o es de otra versión del índice)
+        self.spatial = SpatialIndex.load(index_folder, index_version(ix))
+        self.spatial_weight = spatial_weight
+        # columnas de los campos numéricos (None si no existen o son de otra versión del índice)
+        self.columns = ColumnStore.load(ix)
+
+    # Ordena por la combinación de la puntuación de texto (normalizada por la máxima) y el grado de solapamiento de la
+    # caja de cada documento con la de la consulta: (1 - peso) * texto + peso * solapamiento. Devuelve los 100
+    # primeros documentos como tuplas (path, score, identifier).
+    # Un documento fuera de la caja que no está entre los 100 primeros por texto no puede entrar en los 100 primeros,
+    # ya que esos 100 tienen al menos su misma puntuación combinada. Por eso solo se puntúan por texto esos 100 y los
+    # documentos de la caja (el And con el filtro solo avanza por ellos), sin recorrer todos los que cumplen la query
+    def blended_search(self, query, west, south, east, north):
+        spatial_docs, overlaps = self.spatial.overlaps(west, south, east, north)
+        top_hits = self.searcher.search(query, limit = 100)
+        max_score = top_hits[0].score if len(top_hits) else 0.0
+        box_hits = self.searcher.search(And([query, FilterQuery(spatial_docs)]), limit = None)
+        text_hits = dict((hit.docnum, hit.score) for hit in top_hits)
+        text_hits.update((hit.docnum, hit.score) for hit in box_hits)
+        text_docs = np.fromiter(text_hits.keys(), dtype=np.int64, count=len(text_hits))
+        text_scores = np.fromiter(text_hits.values(), dtype=np.float64, count=len(text_hits))
+        docs = np.union1d(text_docs, spatial_docs)
+        scores = np.zeros(len(docs))
+        if len(text_docs) and max_score > 0:
+            scores[np.searchsorted(docs, text_docs)] += (1 - self.spatial_weight) * text_scores / max_score
+        scores[np.searchsorted(docs, spatial_docs)] += self.spatial_weight * overlaps
+        # mayor puntuación primero y, a igual puntuación, menor número de documento
+        top = np.lexsort((docs, -scores))[:100]
+        results = []
+        for position in top:
+            fields = self.searcher.stored_fields(int(docs[position]))
+            results.append((fields.get("path"), float(scores[position]), fields.get("identifier")))
+        return results
+
+    # Documentos cuya caja corta a la de la consulta según las columnas de coordenadas, ordenados. Los documentos sin
+    # BoundingBox (NaN) no cumplen ninguna comparación
+    def box_docs(self, west, south, east, north):
+        columns = self.columns
+        mask = ((columns['west'] <= east) & (columns['east'] >= west) &
+                (columns['south'] <= north) & (columns['north'] >= south))
+        return np.flatnonzero(mask)
 
-        
     def search(self, query_text, query_count,output_file):
         spatial_query = None
         west, east, south, north, not_spacial_query=findCoord(query_text)
+        if (west is not None and east is not None and north is not None and south is not None
+                and self.spatial is not None and self.spatial_weight > 0):
+            query = self.parser.parse(not_spacial_query)
+            print("Búsqueda de la Query procesada: ", query,
+                  f"combinada con spatial:{west},{east},{south},{north} (peso {self.spatial_weight})")
+            results = self.blended_search(query, float(west), float(south), float(east), float(north))
+            self.write_results(results, query_count, output_file)
+            return
         if west is not None and east is not None and north is not None and south is not None:
-            westRangeQuery = NumericRange ("west", start = None , end = east )
-            eastRangeQuery = NumericRange ("east", start = west , end = None )
-            northRangeQuery = NumericRange ("north", start = south , end = None )
-            southRangeQuery = NumericRange ("west", start = None , end = north )
-            spatial_query = And([westRangeQuery,eastRangeQuery,southRangeQuery,northRangeQuery ])
+            if self.spatial is not None:
+                # documentos cuya caja corta a la de la consulta, obtenidos del R-tree
+                docs = self.spatial.intersecting(float(west), float(south), float(east), float(north))
+                spatial_query = FilterQuery(docs, SPATIAL_SCORE)
+            elif self.columns is not None and all(name in self.columns for name in ('west', 'south', 'east', 'north')):
+                # sin R-tree, la misma condición de corte evaluada sobre las columnas de coordenadas
+                docs = self.box_docs(float(west), float(south), float(east), float(north))
+                spatial_query = FilterQuery(docs, SPATIAL_SCORE)
+            else:
+                westRangeQuery = NumericRange ("west", start = None , end = east )
+                eastRangeQuery = NumericRange ("east", start = west , end = None )
+                northRangeQuery = NumericRange ("north", start = south , end = None )
+                southRangeQuery = NumericRange ("south", start = None , end = north )
+                spatial_query = And([westRangeQuery,eastRangeQuery,southRangeQuery,northRangeQuery ])
             #query=not_spacial_query
         #búsqueda sin las coordenadas
         #
@@ -116,17 +187,21 @@ class MySearcher:
             query = Or([query, spatial_query])
         print("Búsqueda de la Query procesada: ",query)
         results = self.searcher.search(query, limit = 100)
+        results = [(result.get("path"), result.score, result.get("identifier")) for result in results]
+        self.write_results(results, query_count, output_file)
+
+    def write_results(self, results, query_count, output_file):
         print('Returned documents:')
         i = 1
-        for result in results:
-            identifier = result.get("identifier")
-            print(f'{i} - File path: {result.get("path")}, Similarity score: {result.score}, identifier:{result.get("identifier")}')
+        for path, score, identifier in results:
+            print(f'{i} - File path: {path}, Similarity score: {score}, identifier:{identifier}')
             # Escribir el número de consulta y el identificador en el archivo de resultados
             output_file.write(f"{query_count}\t{identifier}\n")
             i += 1
 
 if __name__ == '__main__':
     index_folder = '../whooshindexZaguan' #indice por defecto
+    spatial_weight = SPATIAL_WEIGHT     #peso del solapamiento espacial (0 por defecto: sin combinar con el texto)
     i = 1
     infor=False
     while (i < len(sys.argv)):
@@ -139,9 +214,12 @@ if __name__ == '__main__':
         if sys.argv[i] == '-output':
             resultsFile = sys.argv[i+1] #guarda el fichero de resultados
             i += 1
+        if sys.argv[i] == '-spatialWeight':
+            spatial_weight = float(sys.argv[i+1])   #guarda el peso del solapamiento espacial
+            i += 1
         i = i + 1
 
-    searcher = MySearcher(index_folder)
+    searcher = MySearcher(index_folder, spatial_weight=spatial_weight)
 
      # Procesar las consultas y guardar los resultados
     try:
@@ -0,0 +1,201 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+server.py
+Authors: Carlos Giralt and Berta Olano
+
+Long-running HTTP/JSON search server. Opens the index, builds the parsers and loads the spaCy model once, and
+answers information needs with the same processing as search.py (parseQuery + MySearcher). Concurrent requests are
+served by a pool of searchers; before each search the searcher is moved to the latest generation of the index if a
+new one has been committed (index.py -update).
+Usage: python3 server.py -index <indexPath> [-host <host>] [-port <port>] [-searchers <n>] [-model tfidf|bm25]
+                         [-cache <cacheFolder>]
+
+    POST /search  {"text": "<information need>", "id": "<optional id>"}
+    GET  /search?text=<information need>
+    GET  /health
+"""
+
+import json
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from whoosh.collectors import WrappingCollector
+
+from search import MySearcher, parseQuery, nerText
+
+# Tiempo mínimo (segundos) entre dos comprobaciones de si hay una nueva generación del índice
+REFRESH_INTERVAL = 1.0
+
+class SearchCancelled(Exception):
+    pass
+
+# Collector de Whoosh que detiene la búsqueda en curso en cuanto se activa el evento cancelled
+class CancellableCollector(WrappingCollector):
+    def __init__(self, child, cancelled):
+        self.child = child
+        self.cancelled = cancelled
+
+    def collect_matches(self):
+        child = self.child
+        for sub_docnum in child.matches():
+            if self.cancelled.is_set():
+                raise SearchCancelled
+            child.collect(sub_docnum)
+
+class SearcherPool:
+    def __init__(self, index_folder, size=4, model_type='tfidf', cache_folder=None):
+        self.searchers = queue.Queue()
+        self.last_check = {}
+        searchers = [MySearcher(index_folder, model_type, cache_folder) for _ in range(size)]
+        # un único modelo de spaCy para todos los searchers; el análisis se hace de uno en uno
+        self.nlp = searchers[0].get_nlp()
+        self.nlp_lock = threading.Lock()
+        for searcher in searchers:
+            searcher.nlp = self.nlp
+            self.last_check[id(searcher)] = time.monotonic()
+            self.searchers.put(searcher)
+        self.size = size
+
+    # Toma un searcher libre del pool (esperando si están todos ocupados) y lo devuelve al terminar
+    @contextmanager
+    def searcher(self):
+        searcher = self.searchers.get()
+        try:
+            now = time.monotonic()
+            if now - self.last_check[id(searcher)] >= REFRESH_INTERVAL:
+                self.last_check[id(searcher)] = now
+                searcher.refresh()
+            yield searcher
+        finally:
+            self.searchers.put(searcher)
+
+    # Procesa y ejecuta una necesidad. Si se pasa el evento cancelled, la búsqueda se abandona (SearchCancelled) en
+    # cuanto se activa: se comprueba entre etapas (al obtener el searcher, antes y después del análisis con spaCy y
+    # tras parseQuery) y durante la búsqueda de Whoosh. Una etapa en curso de spaCy o parseQuery termina antes de
+    # que se compruebe el evento
+    def search(self, query_text, cancelled=None):
+        def check():
+            if cancelled is not None and cancelled.is_set():
+                raise SearchCancelled
+        check()
+        with self.searcher() as searcher:
+            check()
+            # el análisis con spaCy solo hace falta si la query no está ya en la caché de queries del searcher
+            nlp_doc = None
+            if searcher.plans is None or query_text not in searcher.plans:
+                with self.nlp_lock:
+                    check()
+                    nlp_doc = self.nlp(nerText(query_text))
+                check()
+            processedQuery = parseQuery(query_text, searcher, nlp_doc)
+            check()
+            if cancelled is None:
+                results = searcher.run_query(processedQuery)
+            else:
+                results = searcher.run_query(processedQuery, lambda collector: CancellableCollector(collector, cancelled))
+            generation = searcher.searcher.reader().generation()
+        return processedQuery, results, generation
+
+    def health(self):
+        with self.searcher() as searcher:
+            return {'status': 'ok', 'generation': searcher.searcher.reader().generation(),
+                    'documents': searcher.searcher.doc_count(), 'searchers': self.size}
+
+class SearchHandler(BaseHTTPRequestHandler):
+    pool = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self.send_json(200, self.pool.health())
+        elif url.path == '/search':
+            params = parse_qs(url.query)
+            self.handle_search(params.get('text', [''])[0], params.get('id', [None])[0])
+        else:
+            self.send_json(404, {'error': f'unknown path {url.path}'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/search':
+            self.send_json(404, {'error': f'unknown path {url.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self.send_json(400, {'error': f'invalid JSON: {e}'})
+            return
+        if not isinstance(body, dict):
+            self.send_json(400, {'error': 'the body must be a JSON object'})
+            return
+        query_text = body.get('text', '')
+        if not isinstance(query_text, str):
+            self.send_json(400, {'error': 'text must be a string'})
+            return
+        self.handle_search(query_text, body.get('id'))
+
+    def handle_search(self, query_text, query_id):
+        if not query_text.strip():
+            self.send_json(400, {'error': 'empty information need'})
+            return
+        start = time.perf_counter()
+        try:
+            processedQuery, results, generation = self.pool.search(query_text)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'id': query_id, 'query': str(processedQuery), 'generation': generation,
+                             'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+                             'results': [{'path': path, 'score': score, 'identifier': identifier}
+                                         for path, score, identifier in results]})
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == '__main__':
+    index_folder = '../whooshindexZaguan'
+    host = '127.0.0.1'
+    port = 8000
+    size = 4
+    model_type = 'tfidf'
+    cache_folder = None
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-index':
+            index_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-host':
+            host = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-port':
+            port = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-searchers':
+            size = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-model':
+            model_type = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-cache':
+            cache_folder = sys.argv[i + 1]
+            i = i + 1
+        i = i + 1
+
+    SearchHandler.pool = SearcherPool(index_folder, size, model_type, cache_folder)
+    server = ThreadingHTTPServer((host, port), SearchHandler)
+    print(f"Servidor de búsqueda en http://{host}:{port} ({size} searchers sobre {index_folder})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,333 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+sparse_search.py
+Authors: Carlos Giralt and Berta Olano
+
+Alternative retrieval backend for search.py that scores with SciPy sparse matrices instead of Whoosh matchers.
+For every indexed field of the pract3 schema the postings of the Whoosh index (the CustomSpanishAnalyzer tokens)
+are turned into a CSC term-document matrix of term frequencies, saved in the SPARSE_FOLDER of the index together
+with the document frequencies, the field lengths and the version of the index it was built for. The queries are
+still built by parseQuery, and the And/Or/Term/NumericRange tree, with its boosts (subject x2.5, title/description
+x1.25, ...), is evaluated as vectorized TF-IDF or BM25F over all the documents with the same formulas as Whoosh.
+The subqueries the matrices cannot evaluate (e.g. phrases or term ranges written in the need) are scored by the
+Whoosh searcher and added to the rest of the tree.
+The results file has the same format as the one of search.py, so evaluation.py can compare both engines.
+Usage: python3 sparse_search.py -index <indexPath> -infoNeeds <queryFile> -output <resultsFile> [-model tfidf|bm25]
+                                [-cache <cacheFolder>] [-rebuild]
+"""
+
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from scipy.sparse import csc_matrix
+from whoosh.fields import NUMERIC
+from whoosh.query import And, Or, Term, NumericRange, Every, NullQuery
+from whoosh.util.numeric import byte_to_length
+
+from column_store import MISSING_INT, numeric_column
+from index_version import index_version
+from result_cache import ResultCache
+from search import MySearcher, parseQuery, PLAN_CACHE_SIZE
+
+SPARSE_FOLDER = 'sparse'
+# Parámetros de BM25F, los de Whoosh por defecto
+BM25_B = 0.75
+BM25_K1 = 1.2
+
+# Matriz CSC (documentos x términos) de las frecuencias de un campo, su vocabulario, la frecuencia en documentos de
+# cada término y, si el campo es puntuable, su longitud en cada documento. La longitud que guarda Whoosh es la suma de
+# las frecuencias de los términos del documento, por lo que se obtiene en la misma pasada por los postings
+def field_matrix(reader, fieldname, scorable):
+    terms, df, indptr, indices, data, freqs = [], [], [0], [], [], []
+    for term in reader.lexicon(fieldname):
+        matcher = reader.postings(fieldname, term)
+        while matcher.is_active():
+            indices.append(matcher.id())
+            data.append(matcher.value_as('weight'))
+            if scorable:
+                freqs.append(matcher.value_as('frequency'))
+            matcher.next()
+        indptr.append(len(indices))
+        terms.append(term.decode('utf-8'))
+        df.append(reader.doc_frequency(fieldname, term))
+    indices = np.array(indices, dtype=np.int32)
+    matrix = csc_matrix((np.array(data, dtype=np.float32), indices, np.array(indptr, dtype=np.int64)),
+                        shape=(reader.doc_count_all(), len(terms)))
+    lengths = None
+    if scorable:
+        lengths = quantized_lengths(np.bincount(indices, weights=np.array(freqs, dtype=np.float64),
+                                                minlength=reader.doc_count_all()))
+    return terms, np.array(df, dtype=np.int64), matrix, lengths
+
+# Longitudes que devolvería doc_field_length: Whoosh las guarda en un byte (length_to_byte) y las recupera con
+# byte_to_length, de modo que cada longitud pasa al menor valor de la tabla de 256 longitudes que no es menor que ella
+LENGTH_TABLE = np.array([byte_to_length(code) for code in range(256)], dtype=np.float64)
+
+def quantized_lengths(lengths):
+    return LENGTH_TABLE[np.minimum(np.searchsorted(LENGTH_TABLE, lengths, side='left'), 255)]
+
+# Construye las matrices de todos los campos indexados de la última versión del índice y las guarda en SPARSE_FOLDER
+def write_matrices(index):
+    folder = os.path.join(index.storage.folder, SPARSE_FOLDER)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    schema = index.schema
+    meta = {'version': index_version(index), 'fields': {}}
+    with index.reader() as reader:
+        meta['doc_count_all'] = reader.doc_count_all()
+        meta['doc_count'] = reader.doc_count()
+        for fieldname in schema.names():
+            field = schema[fieldname]
+            if not field.indexed or isinstance(field, NUMERIC):
+                continue
+            terms, df, matrix, lengths = field_matrix(reader, fieldname, field.scorable)
+            arrays = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr, 'df': df}
+            if field.scorable:
+                arrays['lengths'] = lengths
+            np.savez(os.path.join(folder, fieldname + '.npz'), **arrays)
+            meta['fields'][fieldname] = {'terms': terms, 'scorable': bool(field.scorable),
+                                         'field_length': reader.field_length(fieldname)}
+        live = np.zeros(reader.doc_count_all(), dtype=bool)
+        paths = [None] * reader.doc_count_all()
+        identifiers = [None] * reader.doc_count_all()
+        for docnum, fields in reader.iter_docs():
+            live[docnum] = True
+            paths[docnum] = fields.get('path')
+            identifiers[docnum] = fields.get('identifier')
+        years = numeric_column(reader, schema, 'publishingyear') if 'publishingyear' in schema else None
+    np.savez(os.path.join(folder, 'documents.npz'), live=live,
+             years=years if years is not None else np.full(len(live), MISSING_INT, dtype=np.int32))
+    meta['paths'] = paths
+    meta['identifiers'] = identifiers
+    # los metadatos se escriben al final: hasta entonces las matrices no se consideran válidas
+    tmp_path = os.path.join(folder, 'sparse.tmp.json')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, os.path.join(folder, 'sparse.json'))
+
+# Matrices de un campo: frecuencias, vocabulario (término -> columna), frecuencia en documentos y longitudes
+class SparseField:
+    def __init__(self, path, terms, scorable, field_length, doc_count):
+        with np.load(path) as arrays:
+            self.matrix = csc_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                     shape=(doc_count, len(terms)))
+            self.df = arrays['df']
+            self.lengths = arrays['lengths'] if scorable else None
+        self.columns = {term: column for column, term in enumerate(terms)}
+        self.scorable = scorable
+        self.field_length = field_length
+
+    # Documentos que contienen el término, frecuencia en cada uno y frecuencia en documentos (None si no está en el
+    # vocabulario)
+    def postings(self, text):
+        column = self.columns.get(text)
+        if column is None:
+            return None, None, 0
+        start, end = self.matrix.indptr[column], self.matrix.indptr[column + 1]
+        return self.matrix.indices[start:end], self.matrix.data[start:end].astype(np.float64), self.df[column]
+
+class SparseIndex:
+    def __init__(self, folder, meta):
+        self.version = meta['version']
+        self.doc_count_all = meta['doc_count_all']
+        self.doc_count = meta['doc_count']
+        self.fields = {name: SparseField(os.path.join(folder, name + '.npz'), info['terms'], info['scorable'],
+                                         info['field_length'], self.doc_count_all)
+                       for name, info in meta['fields'].items()}
+        with np.load(os.path.join(folder, 'documents.npz')) as arrays:
+            self.live = arrays['live']
+            self.years = arrays['years']
+        self.paths = meta['paths']
+        self.identifiers = meta['identifiers']
+
+    # Abre las matrices de un índice. Devuelve None si no existen o se construyeron para otra versión del índice
+    @classmethod
+    def load(cls, index):
+        folder = os.path.join(index.storage.folder, SPARSE_FOLDER)
+        meta_path = os.path.join(folder, 'sparse.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta['version'] != index_version(index):
+            return None
+        return cls(folder, meta)
+
+    # Abre las matrices del índice, construyéndolas antes si no existen, están desfasadas o se pide (rebuild)
+    @classmethod
+    def open(cls, index, rebuild=False):
+        matrices = None if rebuild else cls.load(index)
+        if matrices is None:
+            write_matrices(index)
+            matrices = cls.load(index)
+        return matrices
+
+    def idf(self, df):
+        return np.log(self.doc_count_all / (df + 1)) + 1
+
+    # Puntuación de un término en los documentos que lo contienen, como en los scorers TF_IDF y BM25F de Whoosh
+    def term_scores(self, fieldname, text, model_type):
+        field = self.fields.get(fieldname)
+        if field is None:
+            return None, None
+        docs, weights, df = field.postings(text)
+        if docs is None:
+            return None, None
+        if model_type == 'tfidf':
+            return docs, weights * self.idf(df)
+        if not field.scorable:
+            return docs, weights
+        # longitud media sobre todos los documentos, también los borrados (como el searcher de Whoosh)
+        avgfl = field.field_length / (self.doc_count_all or 1) or 1
+        lengths = field.lengths[docs]
+        return docs, self.idf(df) * ((weights * (BM25_K1 + 1)) /
+                                     (weights + BM25_K1 * ((1 - BM25_B) + BM25_B * lengths / avgfl)))
+
+    # Evalúa la query sobre todos los documentos. Devuelve la puntuación de cada documento y los que la cumplen.
+    # fallback(query) evalúa igual las subqueries no soportadas (Phrase, TermRange...); sin él, se lanza ValueError
+    def evaluate(self, query, model_type, fallback=None):
+        scores = np.zeros(self.doc_count_all)
+        matched = np.zeros(self.doc_count_all, dtype=bool)
+        if isinstance(query, (And, Or)):
+            subqueries = query.subqueries
+            if not subqueries:
+                return scores, matched
+            if len(subqueries) == 1:
+                # como Whoosh, una query compuesta con una única subquery no aplica su boost
+                return self.evaluate(subqueries[0], model_type, fallback)
+            matched[:] = isinstance(query, And)
+            for subquery in subqueries:
+                sub_scores, sub_matched = self.evaluate(subquery, model_type, fallback)
+                scores += sub_scores
+                matched = matched & sub_matched if isinstance(query, And) else matched | sub_matched
+            scores[~matched] = 0.0
+            return scores * query.boost, matched
+        if isinstance(query, Term):
+            if query.fieldname == 'publishingyear':
+                try:
+                    year = int(query.text)
+                except ValueError:
+                    return scores, matched
+                matched = self.years == year
+                df = int(matched.sum())
+                scores[matched] = (self.idf(df) if model_type == 'tfidf' else 1.0) * query.boost
+                return scores, matched
+            docs, term_scores = self.term_scores(query.fieldname, query.text, model_type)
+            if docs is not None:
+                scores[docs] = term_scores * query.boost
+                matched[docs] = True
+            return scores, matched
+        if isinstance(query, NumericRange) and query.fieldname == 'publishingyear':
+            # rango de años: puntuación constante (el boost), como el NumericRange de Whoosh
+            matched = self.years != MISSING_INT
+            if query.start is not None:
+                matched &= self.years >= int(query.start) + (1 if query.startexcl else 0)
+            if query.end is not None:
+                matched &= self.years <= int(query.end) - (1 if query.endexcl else 0)
+            scores[matched] = query.boost
+            return scores, matched
+        if isinstance(query, Every):
+            matched[:] = True
+            scores[:] = query.boost
+            return scores, matched
+        if query is NullQuery:
+            return scores, matched
+        if fallback is not None:
+            return fallback(query)
+        raise ValueError(f"Query no soportada por el motor de matrices dispersas: {query!r}")
+
+    # Los limit primeros documentos como tuplas (path, score, identifier): mayor puntuación primero y, a igual
+    # puntuación, menor número de documento
+    def search(self, query, model_type='tfidf', limit=100, fallback=None):
+        scores, matched = self.evaluate(query, model_type, fallback)
+        docs = np.flatnonzero(matched & self.live)
+        top = docs[np.lexsort((docs, -scores[docs]))[:limit]]
+        return [(self.paths[docnum], float(scores[docnum]), self.identifiers[docnum]) for docnum in top]
+
+# MySearcher (parsers, spaCy y caché de queries de search.py) que ejecuta las queries con las matrices dispersas
+class SparseSearcher(MySearcher):
+    def __init__(self, index_folder, model_type='tfidf', cache_folder=None, instrumentation=None,
+                 plan_cache_size=PLAN_CACHE_SIZE, rebuild=False):
+        MySearcher.__init__(self, index_folder, model_type, None, instrumentation, plan_cache_size)
+        self.model_type = model_type
+        self.matrices = SparseIndex.open(self.index, rebuild)
+        # caché de resultados propia del motor, separada de la de Whoosh
+        self.cache = ResultCache(cache_folder, self.index, 'sparse-' + model_type) if cache_folder else None
+
+    def refresh(self):
+        if not MySearcher.refresh(self):
+            return False
+        self.matrices = SparseIndex.open(self.index)
+        return True
+
+    # Puntuación y documentos de una subquery que las matrices no pueden evaluar, con el searcher de Whoosh (sin poda
+    # ni sustitución del matcher, para obtener todos sus documentos)
+    def whooshScores(self, query):
+        scores = np.zeros(self.matrices.doc_count_all)
+        matched = np.zeros(self.matrices.doc_count_all, dtype=bool)
+        collector = self.searcher.collector(limit = None, optimize = False)
+        collector.replace = 0
+        self.searcher.search_with_collector(query, collector)
+        for score, docnum in collector.results().top_n:
+            scores[docnum] = score
+            matched[docnum] = True
+        return scores, matched
+
+    # Ejecuta la query y devuelve los 100 primeros resultados como tuplas (path, score, identifier)
+    def run_query(self, query, wrap_collector=None):
+        probe = self.instrumentation
+        if self.cache is not None:
+            cached = self.cache.get(query)
+            if cached is not None:
+                probe.count('cache_hits')
+                probe.count('hits', len(cached))
+                return cached
+        with probe.timer('sparse'):
+            results = self.matrices.search(query, self.model_type, 100, self.whooshScores)
+        probe.count('hits', len(results))
+        if self.cache is not None:
+            self.cache.put(query, results)
+        return results
+
+if __name__ == '__main__':
+    index_folder = '../whooshindexZaguan'
+    query_file = 'necesidadesInformacion.xml'
+    results_file = 'resultados.txt'
+    model_type = 'tfidf'
+    cache_folder = None
+    rebuild = False
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-index':
+            index_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-infoNeeds':
+            query_file = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-output':
+            results_file = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-model':
+            model_type = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-cache':
+            cache_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-rebuild':
+            rebuild = True
+        i = i + 1
+
+    start = time.perf_counter()
+    searcher = SparseSearcher(index_folder, model_type, cache_folder, rebuild=rebuild)
+    print(f"Matrices de {searcher.matrices.doc_count} documentos abiertas en {time.perf_counter() - start:.2f} s")
+    root = ET.parse(query_file).getroot()
+    needs = [(child.find('identifier').text, child.find('text').text) for child in root.findall('informationNeed')]
+    with open(results_file, 'w', encoding='utf-8') as output_file:
+        nlp_docs = searcher.ner_docs([query for _, query in needs])
+        for (query_count, query), nlp_doc in zip(needs, nlp_docs):
+            print(f"\nEjecutando búsqueda para la query {query_count}: '{query}'")
+            searcher.search(parseQuery(query, searcher, nlp_doc), query_count, output_file)
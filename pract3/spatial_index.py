@@ -0,0 +1,137 @@
+"""
+RECUPERACIÓN DE INFORMACIÓN:PRACTICA 1
+spatial_index.py
+Authors: Carlos Giralt and Berta Olano
+
+
+Spatial index of the BoundingBox of the records indexed by indexNoEvaluable.py. It is a static R-tree packed with
+the Sort-Tile-Recursive (STR) method: the boxes are sorted into tiles of NODE_CAPACITY entries and every upper level
+stores the bounds of NODE_CAPACITY nodes of the level below, so intersection and containment queries only descend
+through the nodes that overlap the query box. The tree is saved next to the Whoosh index (SPATIAL_FILE) together
+with the version of the index it was built for, and searchNoEvaluable.py uses it to get the candidate documents
+of a spatial: query.
+"""
+import math
+import os
+
+import numpy as np
+
+SPATIAL_FILE = 'spatial_rtree.npz'
+# Número de hijos de cada nodo del árbol
+NODE_CAPACITY = 16
+
+# Columnas de las cajas: oeste, sur, este, norte
+WEST, SOUTH, EAST, NORTH = range(4)
+
+# Orden STR de las cajas: franjas verticales por la x del centro y, dentro de cada franja, por la y del centro
+def str_order(boxes, capacity):
+    n = len(boxes)
+    centers_x = (boxes[:, WEST] + boxes[:, EAST]) / 2
+    centers_y = (boxes[:, SOUTH] + boxes[:, NORTH]) / 2
+    slice_size = capacity * max(1, math.ceil(math.sqrt(math.ceil(n / capacity))))
+    order = np.argsort(centers_x, kind='stable')
+    for start in range(0, n, slice_size):
+        tile = order[start:start + slice_size]
+        order[start:start + slice_size] = tile[np.argsort(centers_y[tile], kind='stable')]
+    return order
+
+# Cajas de los nodos de un nivel: cada nodo cubre capacity entradas consecutivas del nivel inferior
+def pack_level(boxes, capacity):
+    starts = np.arange(0, len(boxes), capacity)
+    return np.column_stack([np.minimum.reduceat(boxes[:, WEST], starts), np.minimum.reduceat(boxes[:, SOUTH], starts),
+                            np.maximum.reduceat(boxes[:, EAST], starts), np.maximum.reduceat(boxes[:, NORTH], starts)])
+
+def intersects(boxes, west, south, east, north):
+    return ((boxes[:, WEST] <= east) & (boxes[:, EAST] >= west) &
+            (boxes[:, SOUTH] <= north) & (boxes[:, NORTH] >= south))
+
+def contained(boxes, west, south, east, north):
+    return ((boxes[:, WEST] >= west) & (boxes[:, EAST] <= east) &
+            (boxes[:, SOUTH] >= south) & (boxes[:, NORTH] <= north))
+
+# Grado de solapamiento entre cada caja y la de la consulta: área de la intersección entre área de la unión (entre 0 y
+# 1). Si ambas cajas son degeneradas (puntos o líneas, de área nula) y se cortan, el solapamiento es 1. Si solo lo es
+# la de la consulta, la intersección siempre tiene área nula: el solapamiento es la fracción de la línea de la consulta
+# que queda dentro de cada caja (1 si la contiene entera, o si la consulta es un punto dentro de la caja)
+def overlap_ratio(boxes, west, south, east, north):
+    width = np.clip(np.minimum(boxes[:, EAST], east) - np.maximum(boxes[:, WEST], west), 0, None)
+    height = np.clip(np.minimum(boxes[:, NORTH], north) - np.maximum(boxes[:, SOUTH], south), 0, None)
+    areas = (boxes[:, EAST] - boxes[:, WEST]) * (boxes[:, NORTH] - boxes[:, SOUTH])
+    if (east - west) * (north - south) == 0:
+        hit = intersects(boxes, west, south, east, north)
+        length = max(east - west, north - south)
+        if length == 0:
+            return hit.astype(np.float64)
+        inside = width if east - west > 0 else height
+        return np.where(hit, np.where(areas > 0, inside / length, 1.0), 0.0)
+    overlap = width * height
+    union = areas + (east - west) * (north - south) - overlap
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, overlap / union, 1.0)
+
+class SpatialIndex:
+    # boxes: array (n, 4) con oeste, sur, este y norte de cada documento; docnums: número de documento en Whoosh
+    def __init__(self, boxes, docnums, version, capacity=NODE_CAPACITY, ordered=False):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        docnums = np.asarray(docnums, dtype=np.int64)
+        if not ordered and len(boxes):
+            order = str_order(boxes, capacity)
+            boxes, docnums = boxes[order], docnums[order]
+        self.boxes = boxes
+        self.docnums = docnums
+        self.version = version     # versión del índice (index_version.py) para la que se construyó
+        self.capacity = capacity
+        # niveles superiores del árbol, del nivel inmediatamente superior a las hojas hasta la raíz
+        self.levels = []
+        level = boxes
+        while len(level) > capacity:
+            level = pack_level(level, capacity)
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.docnums)
+
+    # Posiciones (en las hojas) de las cajas que pueden cortar a la consulta, bajando solo por los nodos que la cortan
+    def candidates(self, west, south, east, north):
+        levels = [self.boxes] + self.levels
+        nodes = np.arange(len(levels[-1]))
+        for k in range(len(levels) - 1, 0, -1):
+            nodes = nodes[intersects(levels[k][nodes], west, south, east, north)]
+            # hijos de los nodos que cortan a la consulta
+            nodes = (nodes[:, None] * self.capacity + np.arange(self.capacity)).ravel()
+            nodes = nodes[nodes < len(levels[k - 1])]
+        return nodes
+
+    # Documentos cuya caja corta a la caja de la consulta, ordenados
+    def intersecting(self, west, south, east, north):
+        entries = self.candidates(west, south, east, north)
+        entries = entries[intersects(self.boxes[entries], west, south, east, north)]
+        return np.sort(self.docnums[entries])
+
+    # Documentos cuya caja está contenida en la caja de la consulta, ordenados
+    def within(self, west, south, east, north):
+        entries = self.candidates(west, south, east, north)
+        entries = entries[contained(self.boxes[entries], west, south, east, north)]
+        return np.sort(self.docnums[entries])
+
+    # Documentos cuya caja corta a la de la consulta (ordenados) y el grado de solapamiento de cada uno
+    def overlaps(self, west, south, east, north):
+        entries = self.candidates(west, south, east, north)
+        entries = entries[intersects(self.boxes[entries], west, south, east, north)]
+        entries = entries[np.argsort(self.docnums[entries])]
+        return self.docnums[entries], overlap_ratio(self.boxes[entries], west, south, east, north)
+
+    def save(self, index_folder):
+        np.savez(os.path.join(index_folder, SPATIAL_FILE), boxes=self.boxes, docnums=self.docnums,
+                 version=self.version, capacity=self.capacity)
+
+    # Carga el árbol guardado junto al índice. Devuelve None si no existe o se construyó para otra versión del índice
+    @classmethod
+    def load(cls, index_folder, version):
+        file_path = os.path.join(index_folder, SPATIAL_FILE)
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as data:
+            if 'version' not in data or str(data['version']) != version:
+                return None
+            return cls(data['boxes'], data['docnums'], version, int(data['capacity']), ordered=True)